@@ -0,0 +1,78 @@
+import os
+import pickle
+import logging
+
+
+def default_cache_dir(*parts):
+    # A directory under the per-user cache of the application. platformdirs
+    # is only imported once a cache is actually used.
+    import platformdirs
+
+    app_dirs = platformdirs.AppDirs("FileMergerApp")
+    return os.path.join(app_dirs.user_cache_dir, *parts)
+
+
+def write_atomic(path, write, mode="wb", **open_args):
+    # Calls write with a temporary file next to path, then replaces path with
+    # it in one step, so other processes never read a half-written file
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, mode, **open_args) as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def store_pickle(path, value):
+    write_atomic(
+        path, lambda f: pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    )
+
+
+def load_pickle(path):
+    # The stored value, or None when the file is missing or cannot be read;
+    # a broken cache entry counts as a miss
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Ogiltig cachepost {path}: {str(e)}")
+        return None
+
+
+def touch(path):
+    # Marks an entry as recently used for prune_dir
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def prune_dir(cache_dir, max_bytes):
+    # Deletes the least recently used entries until the rest take up at most
+    # max_bytes, and returns how many were deleted. Temporary files of
+    # writes still in progress are left alone.
+    entries = []
+    for root, dirs, files in os.walk(cache_dir):
+        for name in files:
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+    total = sum(size for mtime, size, path in entries)
+    removed = 0
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
@@ -0,0 +1,285 @@
+import os
+import random
+import pathlib
+import sqlite3
+from collections import namedtuple
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+
+# Schema and size of one table; approximate is True when row_count is an
+# estimate instead of an exact COUNT(*). preview holds formatted rows and
+# preview_truncated tells that a budget cut the preview short.
+TableInfo = namedtuple(
+    "TableInfo",
+    ["name", "columns", "row_count", "approximate", "preview", "preview_truncated"],
+    defaults=[(), False],
+)
+
+# Rows to show per table ("first" rows or a "random" sample) and the hard
+# limits on how much of that ends up in the PDF, per table and per database
+PreviewOptions = namedtuple(
+    "PreviewOptions",
+    ["rows", "mode", "table_bytes", "database_rows", "database_bytes"],
+    defaults=[0, "first", 8 * 1024, 500, 64 * 1024],
+)
+
+# Result for one database file; error is set instead of tables on failure
+DatabaseSummary = namedtuple("DatabaseSummary", ["file", "tables", "error"])
+
+ROW_COUNT_MODES = ("exact", "approximate")
+PREVIEW_MODES = ("first", "random")
+
+# Longer values are cut, a single cell must not fill the page
+MAX_VALUE_CHARS = 200
+FETCH_SIZE = 100
+
+# Runs of neighbouring rowids read to estimate a table's row count
+ESTIMATE_PROBES = 32
+ESTIMATE_RUN = 16
+
+
+def connect_readonly(file, immutable=False):
+    # mode=ro never creates or writes the file. immutable=1 also skips all
+    # locking and WAL checks, which is only safe for snapshots nobody writes.
+    uri = pathlib.Path(os.path.abspath(file)).as_uri()
+    uri += "?immutable=1" if immutable else "?mode=ro"
+    return sqlite3.connect(uri, uri=True)
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def read_schema(conn):
+    # All tables and their columns in one query, in sqlite_master order
+    tables = {}
+    rows = conn.execute(
+        "SELECT m.name, p.name, p.type FROM sqlite_master AS m "
+        "JOIN pragma_table_info(m.name) AS p "
+        "WHERE m.type = 'table' ORDER BY m.rowid, p.cid"
+    )
+    for table, column, column_type in rows:
+        tables.setdefault(table, []).append((column, column_type))
+    return tables
+
+
+def exact_row_count(conn, table):
+    query = f"SELECT COUNT(*) FROM {quote_identifier(table)}"
+    return conn.execute(query).fetchone()[0]
+
+
+def analyzed_row_counts(conn):
+    # The first number of every sqlite_stat1 entry is the row count ANALYZE
+    # saw for the table or one of its indexes
+    try:
+        rows = conn.execute("SELECT tbl, stat FROM sqlite_stat1").fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    counts = {}
+    for table, stat in rows:
+        first = str(stat or "").split(" ", 1)[0]
+        if first.isdigit():
+            counts[table] = max(counts.get(table, 0), int(first))
+    return counts
+
+
+def estimated_row_count(conn, table):
+    # Measures how densely the rowids fill the range between the smallest
+    # and largest one with a few runs of neighbouring rowids, each found
+    # through the b-tree without a scan. Dense tables come out at about
+    # max(rowid), sparse or random keys at the rows actually there. WITHOUT
+    # ROWID tables, and tables too small to measure, fall back to counting.
+    quoted = quote_identifier(table)
+    try:
+        low, high = conn.execute(
+            f"SELECT min(rowid), max(rowid) FROM {quoted}"
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    if low is None:
+        return 0
+    rng = random.Random(table)
+    rowids = gaps = 0
+    for _ in range(ESTIMATE_PROBES):
+        run = [
+            row[0]
+            for row in conn.execute(
+                f"SELECT rowid FROM {quoted} WHERE rowid >= ? ORDER BY rowid LIMIT ?",
+                (rng.randint(low, high), ESTIMATE_RUN),
+            )
+        ]
+        rowids += len(run) - 1
+        gaps += run[-1] - run[0]
+    if not gaps:
+        return None
+    estimate = round((high - low) * rowids / gaps) + 1
+    # A row takes at least a few bytes of a page
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return min(estimate, page_count * page_size // 4)
+
+
+def format_value(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, bytes):
+        return f"<{len(value)} byte>"
+    text = str(value).replace("\r", " ").replace("\n", " ")
+    if len(text) > MAX_VALUE_CHARS:
+        text = text[: MAX_VALUE_CHARS - 1] + "…"
+    return text
+
+
+def fetch_rows(cursor):
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+
+def preview_columns(columns):
+    # Long values are cut in SQL, so a preview never loads a whole BLOB or
+    # TEXT value only to show the start of it. The results format just like
+    # the full values would in format_value.
+    parts = []
+    for name, column_type in columns:
+        column = quote_identifier(name)
+        parts.append(
+            f"CASE typeof({column}) "
+            f"WHEN 'blob' THEN '<' || length({column}) || ' byte>' "
+            f"WHEN 'text' THEN substr({column}, 1, {MAX_VALUE_CHARS + 1}) "
+            f"ELSE {column} END"
+        )
+    return ", ".join(parts)
+
+
+def sampled_rows(conn, table, columns, count):
+    # Seeks to random rowids between the smallest and largest one, which
+    # costs one index lookup per row instead of shuffling the whole table.
+    # The seed is fixed so the same database gives the same sample.
+    quoted = quote_identifier(table)
+    selected = preview_columns(columns)
+    try:
+        low, high = conn.execute(
+            f"SELECT min(rowid), max(rowid) FROM {quoted}"
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # WITHOUT ROWID table
+        cursor = conn.execute(
+            f"SELECT {selected} FROM {quoted} ORDER BY random() LIMIT ?", (count,)
+        )
+        yield from fetch_rows(cursor)
+        return
+    if low is None:
+        return
+    rng = random.Random(table)
+    targets = sorted(rng.sample(range(low, high + 1), min(count, high - low + 1)))
+    seen = set()
+    for target in targets:
+        row = conn.execute(
+            f"SELECT rowid, {selected} FROM {quoted} "
+            "WHERE rowid >= ? ORDER BY rowid LIMIT 1",
+            (target,),
+        ).fetchone()
+        if row is not None and row[0] not in seen:
+            seen.add(row[0])
+            yield row[1:]
+
+
+def preview_rows(conn, table, columns, preview):
+    if preview.mode == "random":
+        return sampled_rows(conn, table, columns, preview.rows)
+    cursor = conn.execute(
+        f"SELECT {preview_columns(columns)} FROM {quote_identifier(table)} LIMIT ?",
+        (preview.rows,),
+    )
+    return fetch_rows(cursor)
+
+
+class PreviewBudget:
+    # What is left of the per-database limits while its tables are read
+
+    def __init__(self, preview):
+        self.rows = preview.database_rows
+        self.bytes = preview.database_bytes
+
+
+def read_preview(conn, table, columns, preview, budget):
+    rows = []
+    table_bytes = 0
+    for row in preview_rows(conn, table, columns, preview):
+        cells = tuple(format_value(value) for value in row)
+        size = sum(len(cell.encode("utf-8")) for cell in cells)
+        if (
+            budget.rows <= 0
+            or size > budget.bytes
+            or table_bytes + size > preview.table_bytes
+        ):
+            return tuple(rows), True
+        rows.append(cells)
+        table_bytes += size
+        budget.rows -= 1
+        budget.bytes -= size
+    return tuple(rows), False
+
+
+def summarize_database(file, row_counts="exact", immutable=False, preview=None):
+    if row_counts not in ROW_COUNT_MODES:
+        raise ValueError(f"Okänt sätt att räkna rader: {row_counts}")
+    if preview and preview.mode not in PREVIEW_MODES:
+        raise ValueError(f"Okänt urval av rader: {preview.mode}")
+    if not os.path.isfile(file):
+        raise FileNotFoundError(f"Databasen {file} finns inte.")
+
+    with closing(connect_readonly(file, immutable)) as conn:
+        schema = read_schema(conn)
+        analyzed = analyzed_row_counts(conn) if row_counts == "approximate" else {}
+        budget = PreviewBudget(preview) if preview and preview.rows > 0 else None
+        tables = []
+        for table, columns in schema.items():
+            count = None
+            if row_counts == "approximate":
+                count = analyzed.get(table)
+                if count is None:
+                    count = estimated_row_count(conn, table)
+            approximate = count is not None
+            if count is None:
+                count = exact_row_count(conn, table)
+            rows, truncated = (), False
+            if budget is not None:
+                rows, truncated = read_preview(conn, table, columns, preview, budget)
+            tables.append(
+                TableInfo(table, columns, count, approximate, rows, truncated)
+            )
+    return tables
+
+
+def summarize_or_error(file, row_counts="exact", immutable=False, preview=None):
+    try:
+        tables = summarize_database(file, row_counts, immutable, preview)
+    except Exception as e:
+        return DatabaseSummary(file, None, e)
+    return DatabaseSummary(file, tables, None)
+
+
+def summarize_databases(
+    files, row_counts="exact", immutable=False, workers=1, preview=None
+):
+    # Yields a DatabaseSummary per file in input order. sqlite3 releases the
+    # GIL while a query runs, so a thread pool reads the databases in parallel.
+    if workers <= 1:
+        for file in files:
+            yield summarize_or_error(file, row_counts, immutable, preview)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [
+            executor.submit(summarize_or_error, file, row_counts, immutable, preview)
+            for file in files
+        ]
+        for future in futures:
+            yield future.result()
+    finally:
+        executor.shutdown(cancel_futures=True)
@@ -0,0 +1,80 @@
+import os
+import threading
+from fpdf import FPDF
+from fontmetrics import WidthTable
+from ttfparser import metrics_path, write_metrics
+
+# Metrics of every TrueType font loaded in this process, keyed by family,
+# style and file. Documents get a copy of the small font dictionary that
+# shares the widths and descriptor with the registry.
+_fonts = {}
+_lock = threading.Lock()
+
+
+def font_key(family, style):
+    family = family.lower()
+    if family == "arial":
+        family = "helvetica"
+    style = style.upper()
+    if style == "IB":
+        style = "BI"
+    return family + style
+
+
+def load_font(family, style, font_file):
+    # FPDF.add_font reads the .pkl metrics next to the font. A missing .pkl
+    # is written here with the faster parser; should that fail, FPDF parses
+    # the font itself.
+    fontkey = font_key(family, style)
+    if not os.path.exists(metrics_path(font_file)):
+        try:
+            write_metrics(font_file, fontkey)
+        except OSError:
+            pass
+    scratch = FPDF()
+    scratch.add_font(family, style, font_file, uni=True)
+    font = scratch.fonts[fontkey]
+    font_files = scratch.font_files[fontkey]
+    # The .pkl keeps the path the font had when it was written, possibly on
+    # another machine; subsets must be read from the font actually found
+    font["ttffile"] = font_files["ttffile"]
+    table = WidthTable.for_font(
+        font_files["ttffile"], font["cw"], font["desc"].get("MissingWidth")
+    )
+    font["cw"] = table.widths
+    return font, font_files, table
+
+
+def get_font(family, style, font_file):
+    key = (font_key(family, style), os.path.abspath(font_file))
+    with _lock:
+        loaded = _fonts.get(key)
+        if loaded is None:
+            loaded = _fonts[key] = load_font(family, style, font_file)
+    return loaded
+
+
+def attach_font(pdf, family, style, font_file):
+    # Does for pdf what FPDF.add_font(..., uni=True) does, without reading
+    # anything from disk once the font is in the registry
+    fontkey = font_key(family, style)
+    if fontkey in pdf.fonts:
+        return
+    font, font_files, table = get_font(family, style, font_file)
+    font = dict(font)
+    font["i"] = len(pdf.fonts) + 1
+    if hasattr(pdf, "str_alias_nb_pages"):
+        font["subset"] = list(range(0, 57))
+    else:
+        font["subset"] = list(range(0, 32))
+    pdf.fonts[fontkey] = font
+    pdf.font_files[fontkey] = dict(font_files)
+    pdf.font_files[font_file] = {"type": "TTF"}
+    pdf.width_tables[fontkey] = table
+
+
+def preload_fonts(fonts):
+    # fonts: (family, style, font_file) tuples
+    for family, style, font_file in fonts:
+        get_font(family, style, font_file)
+
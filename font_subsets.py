@@ -0,0 +1,95 @@
+import os
+import zlib
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+from cache_files import default_cache_dir, load_pickle, store_pickle
+from render_cache import file_digest
+from ttfparser import FastTTFontFile
+
+# Bump when the stored subset format changes
+SUBSET_VERSION = 1
+
+# A TrueType font cut down to the glyphs of one document, ready to embed.
+# stream is the zlib-compressed font program of length bytes uncompressed,
+# cid_to_gid the compressed CIDToGIDMap and max_uni the highest code point.
+Subset = namedtuple("Subset", ["length", "stream", "cid_to_gid", "max_uni"])
+
+# Font file digests by (path, size, mtime), so a font is hashed once per
+# process and not once per document
+_digests = {}
+_lock = threading.Lock()
+
+
+def font_digest(font_file):
+    stat = os.stat(font_file)
+    key = (os.path.abspath(font_file), stat.st_size, stat.st_mtime_ns)
+    with _lock:
+        digest = _digests.get(key)
+    if digest is None:
+        digest = file_digest(font_file)
+        with _lock:
+            _digests[key] = digest
+    return digest
+
+
+def make_subset(font_file, codes):
+    # What FPDF._putfonts builds for a TTF font, without writing it
+    ttf = FastTTFontFile()
+    font_program = ttf.makeSubset(font_file, list(codes))
+    cid_to_gid = bytearray(256 * 256 * 2)
+    for code, glyph in ttf.codeToGlyph.items():
+        cid_to_gid[code * 2] = glyph >> 8
+        cid_to_gid[code * 2 + 1] = glyph & 0xFF
+    return Subset(
+        len(font_program),
+        zlib.compress(font_program),
+        zlib.compress(bytes(cid_to_gid)),
+        ttf.maxUni,
+    )
+
+
+class SubsetCache:
+    # Embedded font subsets stored under the font file's content and the
+    # sorted code points of the subset. Reports mostly use the same ASCII
+    # and Swedish characters, so a subset is usually built only once.
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or default_cache_dir("fonts")
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, font_file, codes):
+        digest = hashlib.sha256()
+        digest.update(font_digest(font_file).encode("ascii"))
+        digest.update(f"\0{SUBSET_VERSION}\0".encode("ascii"))
+        digest.update(",".join(map(str, codes)).encode("ascii"))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".pkl")
+
+    def get(self, key):
+        stored = load_pickle(self.path(key))
+        if stored is None:
+            return None
+        return Subset(*stored)
+
+    def put(self, key, subset):
+        try:
+            store_pickle(self.path(key), tuple(subset))
+        except OSError as e:
+            logging.warning(f"Kunde inte skriva fontcachepost {key}: {str(e)}")
+
+    def subset(self, font_file, codes):
+        codes = sorted(set(codes))
+        key = self.key(font_file, codes)
+        subset = self.get(key)
+        if subset is not None:
+            self.hits += 1
+            return subset
+        self.misses += 1
+        subset = make_subset(font_file, codes)
+        self.put(key, subset)
+        return subset
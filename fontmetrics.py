@@ -0,0 +1,91 @@
+import os
+import mmap
+from array import array
+from cache_files import write_atomic
+
+
+def widths_path(font_file):
+    return os.path.splitext(font_file)[0] + ".cw.bin"
+
+
+def write_widths(path, widths):
+    write_atomic(path, array("H", widths).tofile)
+
+
+def is_current(path, font_file, count):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return stat.st_size == 2 * count and stat.st_mtime >= os.path.getmtime(font_file)
+
+
+def map_widths(path):
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped).cast("H")
+
+
+class WidthTable:
+    # Glyph widths of one font in 1/1000 of the font size, indexed by code
+    # point, in 2 bytes per entry instead of one int object each. Loaded
+    # from a .cw.bin file next to the font, the table is memory-mapped and
+    # shared by every process that uses the font.
+
+    def __init__(self, widths, missing_width=None, path=None):
+        if not isinstance(widths, (array, memoryview)):
+            widths = array("H", widths)
+        self.widths = widths
+        self.missing_width = missing_width or 500
+        self.path = path
+        # Latin-1 text (ASCII and the Swedish letters) is measured a whole
+        # string at a time: bytes.translate maps every byte to the high and
+        # low byte of its width and sum() adds them up without a Python loop.
+        latin1 = [self.width(c) for c in range(256)]
+        self.latin1 = tuple(latin1)
+        self.high = bytes(w >> 8 for w in latin1)
+        self.low = bytes(w & 0xFF for w in latin1)
+
+    @classmethod
+    def load(cls, path, missing_width=None):
+        return cls(map_widths(path), missing_width, path)
+
+    @classmethod
+    def for_font(cls, font_file, cw, missing_width=None):
+        # Writes the .cw.bin file when it is missing or older than the font;
+        # where that is not possible the table stays in memory
+        path = widths_path(font_file)
+        if not is_current(path, font_file, len(cw)):
+            try:
+                write_widths(path, cw)
+            except OSError:
+                return cls(cw, missing_width)
+        return cls.load(path, missing_width)
+
+    def __reduce__(self):
+        # A mapped table is reopened in the receiving process, not copied
+        if self.path:
+            return (WidthTable.load, (self.path, self.missing_width))
+        return (WidthTable, (array("H", self.widths), self.missing_width))
+
+    def __len__(self):
+        return len(self.widths)
+
+    def width(self, code):
+        if code < len(self.widths):
+            return self.widths[code]
+        return self.missing_width
+
+    def char_widths(self, text):
+        try:
+            data = text.encode("latin-1")
+        except UnicodeEncodeError:
+            return list(map(self.width, map(ord, text)))
+        return list(map(self.latin1.__getitem__, data))
+
+    def string_width(self, text):
+        try:
+            data = text.encode("latin-1")
+        except UnicodeEncodeError:
+            return sum(map(self.width, map(ord, text)))
+        return sum(data.translate(self.high)) * 256 + sum(data.translate(self.low))
@@ -7,55 +7,87 @@ from PyQt5.QtWidgets import (
     QCheckBox,
     QFileDialog,
     QMessageBox,
+    QProgressBar,
 )
 from PyQt5.QtCore import QThread, pyqtSignal, Qt, QObject
-from fpdf import FPDF
-import sqlite3
-from merger_utils import (
-    generate_docs,
-    run_tests,
-    get_system_info,
-    extract_text_from_html,
-)
+from merger_utils import generate_extra_info
+from renderer import render_pdf, print_database_info, RenderCancelled
 import logging
-import re
-from bs4 import BeautifulSoup
-from html.parser import HTMLParser
 
 
 class GenerateExtraInfoThread(QObject):
     extra_info_generated = pyqtSignal(str, str, str)
     error_occurred = pyqtSignal(str)
+    progress = pyqtSignal(int, int, str)
+    finished = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    render_failed = pyqtSignal(str)
+    database_error = pyqtSignal(str)
 
-    def __init__(self, include_sphinx):
+    def __init__(self, include_sphinx, files=None, output_file_name="", new_page=False):
         super().__init__()
         self.include_sphinx = include_sphinx
+        self.files = files or []
+        self.output_file_name = output_file_name
+        self.new_page = new_page
+        self.cancel_requested = False
+
+    def cancel(self):
+        # Called from the GUI thread; the renderer polls the flag between
+        # files and pages since this thread is busy until the PDF is done.
+        self.cancel_requested = True
+
+    def is_cancelled(self):
+        return self.cancel_requested
 
     def generate_extra_info(self):
         logging.info("Entering generate_extra_info method")
         try:
-            docs_text = ""
-            if self.include_sphinx:
-                logging.info("Generating Sphinx documentation")
-                docs_text = generate_docs()
-            logging.info("Running tests")
-            tests_text = run_tests()
-            logging.info("Getting system info")
-            system_info = get_system_info()
-            tests_html_path = os.path.join(os.path.dirname(__file__), "tests.html")
-            logging.info(f"tests_html_path: {tests_html_path}")
-            if os.path.exists(tests_html_path):
-                logging.info("tests.html exists, reading its content")
-                with open(tests_html_path, "r", encoding="utf-8") as f:
-                    tests_text = f.read()
-            else:
-                logging.warning("tests.html does not exist")
-                tests_text = "Testrapport saknas"
+            docs_text, tests_text, system_info = generate_extra_info(
+                self.include_sphinx
+            )
             logging.info("Emitting extra_info_generated signal")
             self.extra_info_generated.emit(docs_text, tests_text, system_info)
         except Exception as e:
             logging.exception(f"Error in generate_extra_info method: {str(e)}")
             self.error_occurred.emit(str(e))
+            return
+        self.render(docs_text, tests_text, system_info)
+
+    def render(self, docs_text, tests_text, system_info):
+        if not self.output_file_name:
+            logging.error("Ingen utdatafil vald.")
+            self.render_failed.emit("Ingen utdatafil vald.")
+            return
+        try:
+            render_pdf(
+                self.files,
+                self.output_file_name,
+                docs_text,
+                tests_text,
+                system_info,
+                new_page=self.new_page,
+                include_sphinx=self.include_sphinx,
+                on_error=self.database_error.emit,
+                workers=os.cpu_count() or 1,
+                progress=self.progress.emit,
+                is_cancelled=self.is_cancelled,
+            )
+        except RenderCancelled:
+            logging.info("Sammanslagningen avbröts")
+            self.cancelled.emit()
+            return
+        except (ValueError, FileNotFoundError) as e:
+            logging.warning(str(e))
+            self.render_failed.emit(str(e))
+            return
+        except Exception as e:
+            logging.error(f"Ett fel uppstod vid generering av PDF-fil: {str(e)}")
+            self.render_failed.emit(
+                f"Ett fel uppstod vid generering av PDF-fil: {str(e)}"
+            )
+            return
+        self.finished.emit(self.output_file_name)
 
 
 class FileMergerApp(QWidget):
@@ -92,6 +124,15 @@ class FileMergerApp(QWidget):
         self.include_sphinx_checkbutton = QCheckBox("Inkludera Sphinx-dokumentation")
         layout.addWidget(self.include_sphinx_checkbutton)
 
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setVisible(False)
+        layout.addWidget(self.progress_bar)
+
+        self.cancel_button = QPushButton("Avbryt")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_merge)
+        layout.addWidget(self.cancel_button)
+
         self.setLayout(layout)
 
     def browse_files(self):
@@ -151,21 +192,63 @@ class FileMergerApp(QWidget):
             raise
 
     def start_generate_extra_info_thread(self):
-        self.generate_extra_info_thread = GenerateExtraInfoThread(self.include_sphinx)
-        self.thread = QThread()
-        self.generate_extra_info_thread.moveToThread(self.thread)
-        self.thread.started.connect(self.generate_extra_info_thread.generate_extra_info)
-        self.generate_extra_info_thread.extra_info_generated.connect(
-            self.on_extra_info_generated
+        self.generate_extra_info_thread = GenerateExtraInfoThread(
+            self.include_sphinx,
+            files=list(self.files),
+            output_file_name=self.output_file_name,
+            new_page=self.new_page,
         )
-        self.generate_extra_info_thread.error_occurred.connect(self.on_extra_info_error)
-        self.generate_extra_info_thread.extra_info_generated.connect(self.thread.quit)
+        worker = self.generate_extra_info_thread
+        self.thread = QThread()
+        worker.moveToThread(self.thread)
+        self.thread.started.connect(worker.generate_extra_info)
+        worker.extra_info_generated.connect(self.on_extra_info_generated)
+        worker.progress.connect(self.on_render_progress)
+        worker.database_error.connect(self.show_error)
+        worker.error_occurred.connect(self.on_extra_info_error)
+        worker.render_failed.connect(self.on_render_failed)
+        worker.cancelled.connect(self.on_render_cancelled)
+        worker.finished.connect(self.on_merge_completed)
+        for signal in (
+            worker.error_occurred,
+            worker.render_failed,
+            worker.cancelled,
+            worker.finished,
+        ):
+            signal.connect(self.thread.quit)
+            signal.connect(self.end_merge)
         # Remove the following line
         # self.thread.finished.connect(self.thread.deleteLater)
+        self.merge_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setFormat("Förbereder...")
+        self.progress_bar.setVisible(True)
         self.thread.start()
 
-    def on_merge_completed(self):
-        logging.info("Sammanslagning klar")
+    def cancel_merge(self):
+        logging.info("Avbryter sammanslagning")
+        self.cancel_button.setEnabled(False)
+        self.generate_extra_info_thread.cancel()
+
+    def end_merge(self):
+        self.merge_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        self.progress_bar.setVisible(False)
+
+    def on_render_progress(self, done, total, file):
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+        self.progress_bar.setFormat(f"%v/%m {os.path.basename(file)}")
+
+    def on_render_failed(self, message):
+        QMessageBox.critical(self, "Fel", message)
+
+    def on_render_cancelled(self):
+        QMessageBox.information(self, "Information", "Sammanslagningen avbröts.")
+
+    def on_merge_completed(self, output_file_name=""):
+        logging.info(f"Sammanslagning klar: {output_file_name}")
         QMessageBox.information(self, "Information", "Sammanslagning utförd.")
 
     def toggle_new_page(self, state):
@@ -176,261 +259,10 @@ class FileMergerApp(QWidget):
 
     def on_extra_info_generated(self, docs_text, tests_text, system_info):
         logging.info("Entering on_extra_info_generated method")
-        try:
-            if not self.output_file_name:
-                logging.error("Ingen utdatafil vald.")
-                QMessageBox.critical(self, "Fel", "Ingen utdatafil vald.")
-            return
-            if self.output_file_name.endswith(".pdf"):
-                logging.info("Generating PDF file")
-                pdf = FPDF()
-                font_file = os.path.join(
-                    os.path.dirname(__file__), "DejaVuSansCondensed.ttf"
-                )
-                font_file_bold = os.path.join(
-                    os.path.dirname(__file__), "DejaVuSansCondensed-Bold.ttf"
-                )
-
-                if not os.path.exists(font_file) or not os.path.exists(font_file_bold):
-                    QMessageBox.warning(
-                        self,
-                        "Varning",
-                        "Kunde inte hitta nödvändiga fontfiler. PDF-generering avbruten.",
-                    )
-                    logging.warning(
-                        "Kunde inte hitta nödvändiga fontfiler. PDF-generering avbruten."
-                    )
-                    return
+        self.progress_bar.setFormat("Skapar PDF...")
 
-                pdf.add_font("DejaVu", "", font_file, uni=True)
-                pdf.add_font("DejaVu", "B", font_file_bold, uni=True)
-                pdf.set_font("DejaVu", "", 12)
-                pdf.set_auto_page_break(auto=True, margin=15)
-                pdf.set_margins(left=20, top=20, right=20)
-                pdf.alias_nb_pages()
-
-                # Lägg till separata sidor för varje sektion
-                pdf.add_page()
-                pdf.set_font("DejaVu", "B", 16)
-                pdf.cell(0, 10, "Innehållsförteckning", ln=True, align="C")
-                pdf.ln(10)
-
-                sphinx_bookmark = pdf.add_link()
-                pdf.cell(0, 10, "Sphinx-dokumentation", link=sphinx_bookmark)
-                pdf.ln()
-
-                system_bookmark = pdf.add_link()
-                pdf.cell(0, 10, "Systeminformation", link=system_bookmark)
-                pdf.ln()
-
-                test_bookmark = pdf.add_link()
-                pdf.cell(0, 10, "Testrapport", link=test_bookmark)
-                pdf.ln()
-
-                python_bookmark = pdf.add_link()
-                pdf.cell(0, 10, "Python-filer", link=python_bookmark)
-                pdf.ln()
-
-                database_bookmark = pdf.add_link()
-                pdf.cell(0, 10, "Databasfiler", link=database_bookmark)
-                pdf.ln()
-
-                log_bookmark = pdf.add_link()
-                pdf.cell(0, 10, "Loggfiler", link=log_bookmark)
-                pdf.ln()
-
-                # Sphinx-dokumentation
-                pdf.add_page()
-                pdf.set_font("DejaVu", "B", 16)
-                pdf.cell(0, 10, "Sphinx-dokumentation", ln=True, align="L")
-                pdf.set_font("DejaVu", "", 12)
-                pdf.ln(5)
-                pdf.set_link(sphinx_bookmark)
-                if self.include_sphinx:
-                    pdf.multi_cell(0, 6, docs_text, align="L")
-
-                # Systeminformation
-                pdf.add_page()
-                pdf.set_font("DejaVu", "B", 16)
-                pdf.cell(0, 10, "Systeminformation", ln=True, align="L")
-                pdf.set_font("DejaVu", "", 12)
-                pdf.ln(5)
-                pdf.set_link(pdf.add_link())
-                for line in system_info.split("\n"):
-                    pdf.multi_cell(0, 6, line, align="L")
-
-                # Testrapport
-                pdf.add_page()
-                test_bookmark = pdf.add_link()
-                pdf.set_font("DejaVu", "B", 16)
-                pdf.cell(0, 10, "Testrapport", ln=True, align="L")
-                pdf.set_font("DejaVu", "", 12)
-                pdf.ln(5)
-                pdf.set_link(test_bookmark)
-                pdf.multi_cell(0, 6, tests_text, align="L")
-
-                # Python-filer
-                python_bookmark = pdf.add_link()
-                pdf.add_page()
-                pdf.set_font("DejaVu", "B", 16)
-                pdf.cell(0, 10, "Python-filer", ln=True, align="L")
-                pdf.ln(5)
-                pdf.set_link(pdf.add_link())
-
-                for file in self.files:
-                    if file.endswith(".py"):
-                        pdf.set_font("DejaVu", "B", 12)
-                        pdf.cell(0, 10, f"Filsökväg: {file}", ln=True, align="L")
-                        pdf.cell(
-                            0,
-                            10,
-                            f"Filnamn: {os.path.basename(file)}",
-                            ln=True,
-                            align="L",
-                        )
-                        pdf.set_font("DejaVu", "", 12)
-                        pdf.ln(5)
-
-                        with open(file, "r", encoding="utf-8", errors="replace") as f:
-                            content = f.read()
-
-                        # Split the content into lines
-                        lines = content.split("\n")
-
-                        # Iterate over the lines and add them to the PDF
-                        for line in lines:
-                            # Check if the line is too long to fit within the page width
-                            if pdf.get_string_width(line) > pdf.w - 40:
-                                # Split the line into multiple lines
-                                words = line.split()
-                                new_line = ""
-                                for word in words:
-                                    if (
-                                        pdf.get_string_width(new_line + " " + word)
-                                        < pdf.w - 40
-                                    ):
-                                        new_line += " " + word
-                                    else:
-                                        pdf.multi_cell(0, 6, new_line, align="L")
-                                        new_line = word
-                                # Add the remaining line
-                                pdf.multi_cell(0, 6, new_line, align="L")
-                            else:
-                                pdf.multi_cell(0, 6, line, align="L")
-
-                        pdf.ln(5)
-
-                        if self.new_page:
-                            pdf.add_page()
-                        else:
-                            pdf.ln(5)
-
-                # Databasfiler
-                database_bookmark = pdf.add_link()
-                pdf.add_page()
-                pdf.set_font("DejaVu", "B", 16)
-                pdf.cell(0, 10, "Databasfiler", ln=True, align="L")
-                pdf.ln(5)
-                pdf.set_link(pdf.add_link())
-
-                for file in self.files:
-                    if file.endswith(".db"):
-                        pdf.set_font("DejaVu", "B", 12)
-                        pdf.cell(0, 10, f"Filsökväg: {file}", ln=True, align="L")
-                        pdf.cell(
-                            0,
-                            10,
-                            f"Filnamn: {os.path.basename(file)}",
-                            ln=True,
-                            align="L",
-                        )
-                        pdf.set_font("DejaVu", "", 12)
-                        pdf.ln(5)
-                        self.print_database_info(pdf, file)
-
-                        if self.new_page:
-                            pdf.add_page()
-                        else:
-                            pdf.ln(5)
-
-                # Loggfiler
-                log_bookmark = pdf.add_link()
-                pdf.add_page()
-                pdf.set_font("DejaVu", "B", 16)
-                pdf.cell(0, 10, "Loggfiler", ln=True, align="L")
-                pdf.ln(5)
-                pdf.set_link(pdf.add_link())
-
-                for file in self.files:
-                    if file.endswith(".log"):
-                        pdf.set_font("DejaVu", "B", 12)
-                        pdf.cell(0, 10, f"Filsökväg: {file}", ln=True, align="L")
-                        pdf.cell(
-                            0,
-                            10,
-                            f"Filnamn: {os.path.basename(file)}",
-                            ln=True,
-                            align="L",
-                        )
-                        pdf.set_font("DejaVu", "", 12)
-                        pdf.ln(5)
-
-                        with open(file, "r", encoding="utf-8") as f:
-                            content = f.read()
-
-                        # Split the content into lines
-                        lines = content.split("\n")
-
-                        # Iterate over the lines and add them to the PDF
-                        for line in lines:
-                            # Check if the line is too long to fit within the page width
-                            if pdf.get_string_width(line) > pdf.w - 40:
-                                # Split the line into multiple lines
-                                words = line.split()
-                                new_line = ""
-                                for word in words:
-                                    if (
-                                        pdf.get_string_width(new_line + " " + word)
-                                        < pdf.w - 40
-                                    ):
-                                        new_line += " " + word
-                                    else:
-                                        pdf.multi_cell(0, 6, new_line, align="L")
-                                        new_line = word
-                                # Add the remaining line
-                                pdf.multi_cell(0, 6, new_line, align="L")
-                            else:
-                                pdf.multi_cell(0, 6, line, align="L")
-
-                        pdf.ln(5)
-
-                        if self.new_page:
-                            pdf.add_page()
-                        else:
-                            pdf.ln(5)
-
-                try:
-                    pdf.output(self.output_file_name)
-                    logging.info(f"Sammanslagen fil skapad: {self.output_file_name}")
-                except Exception as e:
-                    logging.error(
-                        f"Ett fel uppstod vid skapande av sammanslagen fil: {str(e)}"
-                    )
-                    QMessageBox.critical(
-                        self,
-                        "Fel",
-                        f"Ett fel uppstod vid skapande av sammanslagen fil: {str(e)}",
-                    )
-            else:
-                logging.warning("Endast PDF-format stöds för närvarande.")
-                QMessageBox.warning(
-                    self, "Varning", "Endast PDF-format stöds för närvarande."
-                )
-        except Exception as e:
-            logging.error(f"Ett fel uppstod vid generering av PDF-fil: {str(e)}")
-            QMessageBox.critical(
-                self, "Fel", f"Ett fel uppstod vid generering av PDF-fil: {str(e)}"
-            )
+    def show_error(self, message):
+        QMessageBox.critical(self, "Fel", message)
 
     def on_extra_info_error(self, error_msg):
         QMessageBox.critical(
@@ -449,44 +281,4 @@ class FileMergerApp(QWidget):
         self.include_sphinx_checkbutton.setChecked(self.include_sphinx)
 
     def print_database_info(self, pdf, file):
-        try:
-            conn = sqlite3.connect(file)
-            cursor = conn.cursor()
-
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = cursor.fetchall()
-
-            if not tables:
-                pdf.cell(0, 10, "Databasen är tom.", ln=True, align="L")
-                pdf.ln(5)
-                return
-
-            for table in tables:
-                pdf.set_font("DejaVu", "B", 12)
-                pdf.cell(0, 10, f"Tabell: {table[0]}", ln=True, align="L")
-                pdf.set_font("DejaVu", "", 12)
-                cursor.execute(f"PRAGMA table_info({table[0]})")
-                columns = cursor.fetchall()
-
-                for column in columns:
-                    pdf.cell(
-                        0,
-                        10,
-                        f"  Kolumn: {column[1]}, Typ: {column[2]}",
-                        ln=True,
-                        align="L",
-                    )
-
-                cursor.execute(f"SELECT COUNT(*) FROM {table[0]};")
-                row_count = cursor.fetchone()[0]
-                pdf.cell(0, 10, f"  Antal rader: {row_count}", ln=True, align="L")
-                pdf.ln(5)
-
-            conn.close()
-
-        except Exception as e:
-            QMessageBox.critical(
-                self, "Fel", f"Ett fel uppstod vid läsning av databasen: {str(e)}"
-            )
-            logging.error(f"Fel vid läsning av databasen: {str(e)}")
-            pdf.ln(5)
+        print_database_info(pdf, file, on_error=self.show_error)
@@ -0,0 +1,186 @@
+import os
+import re
+import mmap
+import codecs
+from datetime import datetime, timedelta
+from itertools import islice
+from contextlib import contextmanager
+
+CHUNK_SIZE = 1024 * 1024
+
+# The %(asctime)s prefix merge.py writes, e.g. "2024-05-01 12:34:56,789".
+# Compared as text, so only the part down to seconds is used.
+TIMESTAMP = re.compile(rb"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d")
+TIMESTAMP_LENGTH = 19
+# A timestamp at the start of a line other than the first. Searching for the
+# newline in front is several times faster than a multiline "^".
+LINE_TIMESTAMP = re.compile(rb"\n(" + TIMESTAMP.pattern + rb")")
+TIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+RELATIVE_TIME = re.compile(r"(\d+)([smhd])")
+TIME_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+
+# What may differ between lines that are still counted as repeats in
+# "similar" mode: timestamps (with or without milliseconds) and numbers
+VARYING_PARTS = re.compile(
+    r"\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d(?:[.,]\d+)?|\d+(?:\.\d+)?"
+)
+COLLAPSE_MODES = ("identical", "similar")
+
+
+def parse_time(value, now=None, end=False):
+    # An absolute time as in the log, or a duration such as "90m" or "1h"
+    # counted back from now. Returned in the log's own sortable format. With
+    # end set, a day or a minute stands for its last second, so an until
+    # time of "2024-05-01" takes in all of that day.
+    value = value.strip()
+    match = RELATIVE_TIME.fullmatch(value)
+    if match:
+        delta = timedelta(**{TIME_UNITS[match.group(2)]: int(match.group(1))})
+        moment = (now or datetime.now()) - delta
+        return moment.strftime(TIME_FORMATS[0])
+    for time_format in TIME_FORMATS:
+        try:
+            moment = datetime.strptime(value, time_format)
+        except ValueError:
+            continue
+        if end and "%S" not in time_format:
+            moment = moment.replace(second=59)
+            if "%M" not in time_format:
+                moment = moment.replace(hour=23, minute=59)
+        return moment.strftime(TIME_FORMATS[0])
+    raise ValueError(f"Ogiltig tidpunkt: {value}")
+
+
+def parse_until(value, now=None):
+    return parse_time(value, now, end=True)
+
+
+@contextmanager
+def mapped_file(file):
+    with open(file, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # An empty file cannot be mapped, bytes has the same interface
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def decode_lines(data, start, end, chunk_size=CHUNK_SIZE):
+    # Yields the lines of data[start:end] like .decode().split("\n") would,
+    # decoding one chunk at a time. Invalid bytes become U+FFFD.
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    for offset in range(start, end, chunk_size):
+        text = pending + decoder.decode(data[offset : min(offset + chunk_size, end)])
+        lines = text.split("\n")
+        pending = lines.pop()
+        yield from lines
+    yield pending + decoder.decode(b"", final=True)
+
+
+def iter_lines(file, chunk_size=CHUNK_SIZE):
+    with mapped_file(file) as data:
+        yield from decode_lines(data, 0, len(data), chunk_size)
+
+
+def next_line_start(data, pos):
+    if pos == 0:
+        return 0
+    newline = data.find(b"\n", pos - 1)
+    return len(data) if newline < 0 else newline + 1
+
+
+def first_timestamp(data, pos, end):
+    # Start and timestamp of the first line from pos on that has one, found
+    # with a regex search that stops after the line starting just before end.
+    # Lines without (tracebacks, wrapped messages) belong to the record above.
+    if pos == 0 and TIMESTAMP.fullmatch(data[:TIMESTAMP_LENGTH]):
+        return 0, data[:TIMESTAMP_LENGTH]
+    endpos = min(end + TIMESTAMP_LENGTH, len(data))
+    match = LINE_TIMESTAMP.search(data, max(pos - 1, 0), endpos)
+    if match is None:
+        return None, None
+    return match.start(1), match.group(1)
+
+
+def find_time(data, moment, after=False):
+    # Binary search for the first record logged at moment, or after it when
+    # after is set. A probe only searches up to the current upper bound; the
+    # start of the first record from high on is kept in found, so a log
+    # without timestamps is searched through about once in total.
+    moment = moment.encode("ascii")
+    low, high = 0, len(data)
+    found = len(data)
+    while low < high:
+        mid = (low + high) // 2
+        pos, timestamp = first_timestamp(data, next_line_start(data, mid), high)
+        if timestamp is None or timestamp > moment or (
+            timestamp == moment and not after
+        ):
+            # Nothing from mid to high is earlier, the answer is at or before mid
+            high = mid
+            if pos is not None:
+                found = pos
+        else:
+            low = mid + 1
+    return found
+
+
+def tail_start(data, start, end, count):
+    # Start of the last count lines in data[start:end], found by searching
+    # backwards from the end so only those lines are read
+    pos = end
+    if pos > start and data[pos - 1 : pos] == b"\n":
+        pos -= 1
+    for _ in range(count):
+        pos = data.rfind(b"\n", start, pos)
+        if pos < 0:
+            return start
+    return pos + 1
+
+
+def select_lines(file, head=None, tail=None, since=None, until=None):
+    # Lines of a log limited to a time window and then to its first head or
+    # last tail lines. Without any limits this is iter_lines(file).
+    with mapped_file(file) as data:
+        start, end = 0, len(data)
+        if since:
+            start = find_time(data, since)
+        if until:
+            end = max(start, find_time(data, until, after=True))
+        if tail:
+            start = tail_start(data, start, end, tail)
+        if start >= end:
+            # Nothing selected, decode_lines would still yield one empty line
+            return
+        lines = decode_lines(data, start, end)
+        if head:
+            lines = islice(lines, head)
+        yield from lines
+
+
+def repeat_key(line, mode):
+    if mode == "similar":
+        return VARYING_PARTS.sub("#", line)
+    return line
+
+
+def collapse_repeats(lines, mode="identical"):
+    # Runs of consecutive repeated lines become their first line followed by
+    # "×N". Only the current run is kept, so this streams like its input.
+    # Empty lines are left alone, they separate blocks rather than repeat.
+    if mode not in COLLAPSE_MODES:
+        raise ValueError(f"Okänt sätt att slå ihop rader: {mode}")
+    first = key = None
+    count = 0
+    for line in lines:
+        line_key = repeat_key(line, mode)
+        if count and line and line_key == key:
+            count += 1
+            continue
+        if count:
+            yield first if count == 1 else f"{first} ×{count}"
+        first, key, count = line, line_key, 1
+    if count:
+        yield first if count == 1 else f"{first} ×{count}"
@@ -1,20 +1,264 @@
 import os
 import sys
+import argparse
 import logging
-from gui import FileMergerApp
-from PyQt5.QtWidgets import QApplication
+import threading
+import multiprocessing
 
 logging.basicConfig(level=logging.INFO)
 
 
-def run_gui():
+def preload_fonts():
+    # Loads the PDF fonts while the window opens or the tests run, and
+    # rebuilds their metric files if they are missing. Not a daemon thread,
+    # so a metric file is never left half-written at exit.
+    def run():
+        try:
+            from renderer import preload_fonts
+
+            preload_fonts()
+        except Exception as e:
+            logging.warning(f"Kunde inte förladda fonter: {str(e)}")
+
+    thread = threading.Thread(target=run, name="font-preload")
+    thread.start()
+    return thread
+
+
+def run_gui(exit_after_start=False):
+    from gui import FileMergerApp
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QTimer
+
     app = QApplication([])
     window = FileMergerApp(files=[])
     window.show()
+    if exit_after_start:
+        # Quit once the event loop has shown the window, for startup timing
+        QTimer.singleShot(0, app.quit)
     return app.exec_()
 
 
+def run_batch(
+    files,
+    output_file_name,
+    new_page=False,
+    include_sphinx=False,
+    use_cache=True,
+    workers=1,
+    docs_source_root=None,
+    docs_excludes=None,
+    docs_builder="text",
+    test_workers=1,
+    test_timeout=600,
+    coverage_html=False,
+    row_counts="exact",
+    db_immutable=False,
+    db_preview=0,
+    db_preview_mode="first",
+    log_head=None,
+    log_tail=None,
+    log_since=None,
+    log_until=None,
+    log_collapse=None,
+    compress_level=6,
+):
+    from merger_utils import generate_extra_info, DEFAULT_DOCS_EXCLUDES
+    from renderer import render_pdf, LayoutOptions
+    from dbsummary import PreviewOptions
+
+    for file in files:
+        if not os.path.isfile(file):
+            logging.error(f"Filen {file} finns inte.")
+            return 1
+
+    logging.info("Sammanfogning påbörjad")
+    logging.info(f"Valda filer: {files}")
+    try:
+        docs_text, tests_text, system_info = generate_extra_info(
+            include_sphinx,
+            docs_source_root=docs_source_root,
+            docs_excludes=DEFAULT_DOCS_EXCLUDES + tuple(docs_excludes or ()),
+            docs_builder=docs_builder,
+            test_workers=test_workers,
+            test_timeout=test_timeout,
+            use_cache=use_cache,
+            coverage_html=coverage_html,
+        )
+        render_pdf(
+            files,
+            output_file_name,
+            docs_text,
+            tests_text,
+            system_info,
+            new_page=new_page,
+            include_sphinx=include_sphinx,
+            use_cache=use_cache,
+            workers=workers,
+            options=LayoutOptions(
+                row_counts=row_counts,
+                db_immutable=db_immutable,
+                db_preview=PreviewOptions(db_preview, db_preview_mode),
+                log_head=log_head,
+                log_tail=log_tail,
+                log_since=log_since,
+                log_until=log_until,
+                log_collapse=log_collapse,
+            ),
+            compress_level=compress_level,
+        )
+    except Exception as e:
+        logging.error(f"Ett fel uppstod vid generering av PDF-fil: {str(e)}")
+        return 1
+    return 0
+
+
+def at_least(minimum):
+    # argparse type for a whole number of at least minimum
+    def parse(value):
+        try:
+            number = int(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"ogiltigt heltal: {value}")
+        if number < minimum:
+            raise argparse.ArgumentTypeError(f"måste vara minst {minimum}: {value}")
+        return number
+
+    return parse
+
+
+def parse_args(argv=None):
+    from logreader import parse_time, parse_until
+
+    parser = argparse.ArgumentParser(
+        description="Sammanslå filer till en PDF. Utan --files startas GUI:t."
+    )
+    parser.add_argument("--files", nargs="+", help="Filer att sammanslå")
+    parser.add_argument("--out", help="Utdatafil (.pdf)")
+    parser.add_argument(
+        "--new-page",
+        action="store_true",
+        help="Starta varje dokument på en ny sida",
+    )
+    parser.add_argument(
+        "--sphinx", action="store_true", help="Inkludera Sphinx-dokumentation"
+    )
+    parser.add_argument(
+        "--docs-root",
+        help="Katalog vars moduler dokumenteras med Sphinx (standard: aktuell)",
+    )
+    parser.add_argument(
+        "--docs-exclude",
+        nargs="+",
+        default=[],
+        help="Ytterligare kataloger eller filer som inte ska dokumenteras",
+    )
+    parser.add_argument(
+        "--docs-builder",
+        choices=["text", "html"],
+        default="text",
+        help="Sphinx-byggare; html skriver även HTML-dokumentationen till docs",
+    )
+    parser.add_argument(
+        "--test-workers",
+        type=at_least(1),
+        default=1,
+        help="Antal processer som testfilerna fördelas på",
+    )
+    parser.add_argument(
+        "--test-timeout",
+        type=float,
+        default=600,
+        help="Maximal tid i sekunder för teststeget",
+    )
+    parser.add_argument(
+        "--coverage-html",
+        action="store_true",
+        help="Skriv även täckningsrapporten som HTML till tests_html",
+    )
+    parser.add_argument(
+        "--row-counts",
+        choices=["exact", "approximate"],
+        default="exact",
+        help="Räkna rader i databaser exakt eller uppskatta dem (snabbt)",
+    )
+    parser.add_argument(
+        "--db-immutable",
+        action="store_true",
+        help="Öppna databaser som oföränderliga ögonblicksbilder utan låsning",
+    )
+    parser.add_argument(
+        "--db-preview",
+        type=at_least(0),
+        default=0,
+        help="Visa upp till så många rader per databastabell (0 = inga)",
+    )
+    parser.add_argument(
+        "--db-preview-mode",
+        choices=["first", "random"],
+        default="first",
+        help="Visa de första raderna eller ett slumpmässigt urval",
+    )
+    parser.add_argument(
+        "--log-head",
+        type=at_least(1),
+        help="Visa bara de första N raderna av varje logg",
+    )
+    parser.add_argument(
+        "--log-tail",
+        type=at_least(1),
+        help="Visa bara de sista N raderna av varje logg",
+    )
+    parser.add_argument(
+        "--log-since",
+        type=parse_time,
+        help="Visa loggposter från tidpunkten ('ÅÅÅÅ-MM-DD TT:MM' eller t.ex. 1h)",
+    )
+    parser.add_argument(
+        "--log-until",
+        type=parse_until,
+        help="Visa loggposter till och med tidpunkten (ett datum tar med hela dagen)",
+    )
+    parser.add_argument(
+        "--log-collapse",
+        choices=["identical", "similar"],
+        help="Slå ihop upprepade loggrader till en rad med ×N (similar bortser "
+        "från tidsstämplar och tal)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Kör tester och lägg ut alla filer på nytt utan cache",
+    )
+    parser.add_argument(
+        "--workers",
+        type=at_least(0),
+        default=0,
+        help="Antal processer för layout av filer (0 = alla kärnor)",
+    )
+    parser.add_argument(
+        "--compress-level",
+        type=int,
+        choices=range(10),
+        default=6,
+        metavar="0-9",
+        help="zlib-nivå för sidornas innehåll: 1 snabbast, 9 minst, 0 okomprimerat",
+    )
+    parser.add_argument(
+        "--exit-after-start",
+        action="store_true",
+        help="Avsluta när fönstret har visats (för att mäta starttiden)",
+    )
+    args = parser.parse_args(argv)
+    if args.files and not args.out:
+        parser.error("--out krävs tillsammans med --files")
+    return args
+
+
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    args = parse_args()
+
     log_dir = "logs"
     os.makedirs(log_dir, exist_ok=True)
     log_file = os.path.join(log_dir, "merge.log")
@@ -24,6 +268,33 @@ if __name__ == "__main__":
         format="%(asctime)s - %(levelname)s - %(message)s",
     )
     logging.info(f"Logging to {log_file}")
+    preload_fonts()
 
-    exit_code = run_gui()
+    if args.files:
+        exit_code = run_batch(
+            args.files,
+            args.out,
+            new_page=args.new_page,
+            include_sphinx=args.sphinx,
+            use_cache=not args.no_cache,
+            workers=args.workers or os.cpu_count() or 1,
+            docs_source_root=args.docs_root,
+            docs_excludes=args.docs_exclude,
+            docs_builder=args.docs_builder,
+            test_workers=args.test_workers,
+            test_timeout=args.test_timeout,
+            coverage_html=args.coverage_html,
+            row_counts=args.row_counts,
+            db_immutable=args.db_immutable,
+            db_preview=args.db_preview,
+            db_preview_mode=args.db_preview_mode,
+            log_head=args.log_head,
+            log_tail=args.log_tail,
+            log_since=args.log_since,
+            log_until=args.log_until,
+            log_collapse=args.log_collapse,
+            compress_level=args.compress_level,
+        )
+    else:
+        exit_code = run_gui(exit_after_start=args.exit_after_start)
     sys.exit(exit_code)
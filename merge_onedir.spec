@@ -0,0 +1,88 @@
+# -*- mode: python ; coding: utf-8 -*-
+# Onedir build of merge.exe: nothing is unpacked or UPX-decompressed at
+# launch, and Qt libraries and packages the GUI never loads are left out.
+# Build with "pyinstaller merge_onedir.spec", output in dist/merge_onedir.
+
+# Test-only packages (tests run in a separate Python) and unused optionals
+EXCLUDED_MODULES = [
+    'pytest',
+    '_pytest',
+    'pytestqt',
+    'pytest_mock',
+    'pytest_cov',
+    'pluggy',
+    'iniconfig',
+    'PIL',
+    'tkinter',
+    'PyQt5.QtNetwork',
+    'PyQt5.QtQml',
+    'PyQt5.QtQuick',
+    'PyQt5.QtSql',
+    'PyQt5.QtTest',
+    'PyQt5.QtWebSockets',
+    'PyQt5.QtPrintSupport',
+    'PyQt5.QtOpenGL',
+]
+
+# Qt DLLs only pulled in by plugins for QML, networking or OpenGL
+EXCLUDED_BINARIES = [
+    'Qt5Qml',
+    'Qt5QmlModels',
+    'Qt5Quick',
+    'Qt5WebSockets',
+    'Qt5Network',
+    'opengl32sw',
+    'd3dcompiler_47',
+    'libEGL',
+    'libGLESv2',
+]
+
+
+a = Analysis(
+    ['merge.py'],
+    pathex=[],
+    binaries=[],
+    datas=[
+        ('DejaVuSansCondensed.ttf', '.'),
+        ('DejaVuSansCondensed-Bold.ttf', '.'),
+    ],
+    hiddenimports=[],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=EXCLUDED_MODULES,
+    noarchive=False,
+)
+a.binaries = [
+    binary
+    for binary in a.binaries
+    if not any(name in binary[0] for name in EXCLUDED_BINARIES)
+]
+pyz = PYZ(a.pure)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name='merge',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+    icon=['merge.ico'],
+)
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    name='merge_onedir',
+)
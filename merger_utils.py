@@ -1,22 +1,137 @@
 import os
+import sys
+import json
+import glob
+import time
 import platform
-import platformdirs
-from sphinx.ext import apidoc
-from sphinx.cmd.build import build_main
-import pytest
-from bs4 import BeautifulSoup
+import subprocess
 import tempfile
 import shutil
-import coverage
+import filecmp
+import hashlib
 import logging
+from render_cache import file_digest
+from cache_files import default_cache_dir, write_atomic
 
+# Sphinx, coverage, bs4 and platformdirs are imported by the functions that
+# use them, so opening the GUI does not wait for modules a merge may not need.
 
-def generate_docs():
+# Directories that are never part of the documented code: the bundled
+# virtualenv, build output and old copies of the sources.
+DEFAULT_DOCS_EXCLUDES = ("mergeenv", "build", "dist", "backup", "__pycache__")
+
+# The test stage also leaves out the generated documentation and coverage
+# HTML, e.g. docs/conf.py is not part of the measured code
+TEST_EXCLUDES = DEFAULT_DOCS_EXCLUDES + ("docs", "tests_html")
+
+
+def apidoc_exclude_patterns(source_root, excludes):
+    # apidoc matches fnmatch patterns against absolute paths; "*" also
+    # matches "/", so the second pattern covers nested directories.
+    patterns = []
+    for exclude in excludes:
+        patterns.append(os.path.join(source_root, exclude))
+        patterns.append(os.path.join(source_root, "*", exclude))
+    return patterns
+
+
+def docs_cache_dir(source_root):
+    digest = hashlib.sha1(source_root.encode("utf-8")).hexdigest()[:12]
+    return default_cache_dir("sphinx", digest)
+
+
+def sync_tree(src, dst):
+    # Make dst a copy of src, touching only files that are new or changed so
+    # their timestamps keep telling Sphinx (and anyone else) what is current.
+    copied = 0
+    src_files = set()
+    for root, dirs, files in os.walk(src):
+        rel_root = os.path.relpath(root, src)
+        os.makedirs(os.path.join(dst, rel_root), exist_ok=True)
+        for name in files:
+            rel_path = os.path.normpath(os.path.join(rel_root, name))
+            src_files.add(rel_path)
+            src_path = os.path.join(src, rel_path)
+            dst_path = os.path.join(dst, rel_path)
+            if not os.path.exists(dst_path) or not filecmp.cmp(src_path, dst_path):
+                shutil.copy2(src_path, dst_path)
+                copied += 1
+    for root, dirs, files in os.walk(dst):
+        for name in files:
+            dst_path = os.path.join(root, name)
+            if os.path.relpath(dst_path, dst) not in src_files:
+                os.remove(dst_path)
+    return copied
+
+
+def doc_names(source_dir):
+    # Every generated page, with the index and module overview first
+    names = sorted(
+        os.path.splitext(name)[0]
+        for name in os.listdir(source_dir)
+        if name.endswith(".rst")
+    )
+    first = [name for name in ("index", "modules") if name in names]
+    return first + [name for name in names if name not in first]
+
+
+def read_text_docs(build_dir, names):
+    docs = []
+    for name in names:
+        text_path = os.path.join(build_dir, name + ".txt")
+        if os.path.exists(text_path):
+            with open(text_path, "r", encoding="utf-8") as f:
+                docs.append((name, f.read().strip()))
+        else:
+            logging.warning(f"Documentation page not found - {text_path}")
+    return docs
+
+
+def read_html_docs(build_dir, names):
+    from bs4 import BeautifulSoup
+
+    # Copy changed files of the build to a permanent location
+    permanent_docs_dir = "docs"
+    changed_docs = sync_tree(build_dir, permanent_docs_dir)
+    logging.info(f"Documentation files updated in docs: {changed_docs}")
+
+    docs = []
+    for name in names:
+        html_path = os.path.join(permanent_docs_dir, name + ".html")
+        if os.path.exists(html_path):
+            with open(html_path, "r", encoding="utf-8") as f:
+                soup = BeautifulSoup(f, "html.parser")
+
+                # Extract the main content of the HTML file
+                main_content = soup.find("div", class_="body")
+                if main_content:
+                    docs.append(
+                        (name, main_content.get_text(separator="\n", strip=True))
+                    )
+        else:
+            print(f"Warning: File not found - {html_path}")
+    return docs
+
+
+def format_docs(docs):
+    return "".join(f"--- {name} ---\n\n{text}\n\n" for name, text in docs)
+
+
+def generate_docs(source_root=None, excludes=DEFAULT_DOCS_EXCLUDES, builder="text"):
+    from sphinx.ext import apidoc
+    from sphinx.cmd.build import build_main
+
+    source_root = os.path.abspath(source_root or os.getcwd())
+    # Sources, doctrees and the environment pickle are kept between runs so
+    # Sphinx only rereads modules that changed since the last build.
+    cache_dir = docs_cache_dir(source_root)
+    source_dir = os.path.join(cache_dir, "source")
+    doctree_dir = os.path.join(cache_dir, "doctrees")
+    build_dir = os.path.join(cache_dir, builder)
     try:
-        # Create a temporary directory for Sphinx documentation
-        with tempfile.TemporaryDirectory() as temp_dir:
-            docs_dir = os.path.join(temp_dir, "docs")
-            os.makedirs(docs_dir, exist_ok=True)
+        # Generate the Sphinx sources in a temporary directory first and
+        # copy over only what changed, apidoc rewrites every file.
+        with tempfile.TemporaryDirectory() as docs_dir:
 
             # Create a temporary index.rst file
             index_rst_content = """
@@ -43,9 +158,12 @@ Indices and tables
                 f.write(index_rst_content)
 
             # Create a temporary conf.py file
-            conf_py_content = """
+            conf_py_content = f"""
 # Configuration file for the Sphinx documentation builder.
 
+import sys
+sys.path.insert(0, {source_root!r})
+
 project = 'File Merger'
 copyright = '2024, Your Name'
 author = 'Your Name'
@@ -63,93 +181,298 @@ html_static_path = ['_static']
                 f.write(conf_py_content)
 
             # Generate API documentation
-            apidoc_main = apidoc.main(["--force", "--output-dir", docs_dir, "."])
+            apidoc_main = apidoc.main(
+                ["--force", "--output-dir", docs_dir, source_root]
+                + apidoc_exclude_patterns(source_root, excludes)
+            )
             print(f"API documentation generated with result: {apidoc_main}")
             if apidoc_main != 0:
                 print(f"Error generating API documentation: {apidoc_main}")
 
-            # Build Sphinx documentation
-            build_main_args = [
-                "-b",
-                "html",
-                "-q",
-                docs_dir,
-                os.path.join(docs_dir, "_build"),
-            ]
-            build_main_result = build_main(build_main_args)
-            print(f"Sphinx documentation built with result: {build_main_result}")
-            if build_main_result != 0:
-                print(f"Error building Sphinx documentation: {build_main_result}")
-
-            # Copy the generated '_build' directory to a permanent location
-            docs_build_dir = os.path.join(docs_dir, "_build")
-            permanent_docs_dir = "docs"
-            if os.path.exists(permanent_docs_dir):
-                shutil.rmtree(permanent_docs_dir)
-            shutil.copytree(docs_build_dir, permanent_docs_dir)
-
-            # Read the generated HTML files
-            html_files = [
-                "index.html",
-                "modules.html",
-                "gui.html",
-                "merge.html",
-                "merger_utils.html",
-            ]
-            docs_content = ""
-
-            for file in html_files:
-                html_path = os.path.join(permanent_docs_dir, file)
-                if os.path.exists(html_path):
-                    with open(html_path, "r", encoding="utf-8") as f:
-                        soup = BeautifulSoup(f, "html.parser")
-
-                        # Extract the main content of the HTML file
-                        main_content = soup.find("div", class_="body")
-                        if main_content:
-                            # Format the content for better readability
-                            docs_content += f"--- {file} ---\n\n"
-                            docs_content += main_content.get_text(
-                                separator="\n", strip=True
-                            )
-                            docs_content += "\n\n"
-
-                else:
-                    print(f"Warning: File not found - {html_path}")
-
-            return docs_content
+            changed_sources = sync_tree(docs_dir, source_dir)
+            logging.info(f"Sphinx sources changed: {changed_sources}")
+
+        # Build Sphinx documentation
+        build_main_args = [
+            "-b",
+            builder,
+            "-q",
+            "-d",
+            doctree_dir,
+            source_dir,
+            build_dir,
+        ]
+        build_main_result = build_main(build_main_args)
+        print(f"Sphinx documentation built with result: {build_main_result}")
+        if build_main_result != 0:
+            print(f"Error building Sphinx documentation: {build_main_result}")
+
+        names = doc_names(source_dir)
+        if builder == "html":
+            docs = read_html_docs(build_dir, names)
+        else:
+            docs = read_text_docs(build_dir, names)
+        return format_docs(docs)
 
     except Exception as e:
         print(f"Error generating documentation: {str(e)}")
         return ""
 
 
-def run_tests():
-    logging.info("Running tests")
-    cov = coverage.Coverage()
-    cov.start()
+def find_test_files(source_root):
+    return sorted(glob.glob(os.path.join(source_root, "test_*.py")))
+
+
+def python_executable():
+    # A frozen merge.exe cannot run "-m pytest", use the Python on PATH
+    if getattr(sys, "frozen", False):
+        return shutil.which("python") or shutil.which("python3") or "python"
+    return sys.executable
+
+
+def start_test_shard(test_files, source_root, data_dir, log_path):
+    omit = ",".join(f"*/{name}/*" for name in TEST_EXCLUDES)
+    args = [
+        python_executable(),
+        "-m",
+        "coverage",
+        "run",
+        "--parallel-mode",
+        f"--data-file={os.path.join(data_dir, '.coverage')}",
+        f"--source={source_root}",
+        f"--omit={omit}",
+        "-m",
+        "pytest",
+        "-v",
+    ] + test_files
+    with open(log_path, "wb") as log:
+        return subprocess.Popen(
+            args, cwd=source_root, stdout=log, stderr=subprocess.STDOUT
+        )
+
+
+# Bump when the format of the stored test report changes
+TESTS_REPORT_VERSION = 3
+
+
+def measured_files(source_root, excludes=TEST_EXCLUDES):
+    # The Python files coverage measures, in a stable order
+    for root, dirs, files in os.walk(source_root):
+        dirs[:] = sorted(
+            name for name in dirs if name not in excludes and not name.startswith(".")
+        )
+        for name in sorted(files):
+            if name.endswith(".py"):
+                yield os.path.join(root, name)
+
+
+def tests_cache_key(source_root, test_files):
+    import coverage
+
+    digest = hashlib.sha256()
+    for part in (
+        str(TESTS_REPORT_VERSION),
+        sys.version,
+        python_executable(),
+        coverage.__version__,
+    ):
+        digest.update(part.encode("utf-8") + b"\0")
+    for path in sorted(set(test_files) | set(measured_files(source_root))):
+        digest.update(os.path.relpath(path, source_root).encode("utf-8") + b"\0")
+        digest.update(file_digest(path).encode("ascii"))
+    return digest.hexdigest()
+
+
+def tests_cache_path(source_root):
+    digest = hashlib.sha1(source_root.encode("utf-8")).hexdigest()[:12]
+    return default_cache_dir("tests", digest + ".json")
+
+
+def load_test_result(path, key):
     try:
-        pytest.main(["-v", "test_dummy.py"])
+        with open(path, "r", encoding="utf-8") as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if result.get("key") != key:
+        return None
+    return result
+
+
+def save_test_result(path, result):
+    try:
+        write_atomic(path, lambda f: json.dump(result, f), "w", encoding="utf-8")
+    except OSError as e:
+        logging.warning(f"Could not store test result: {str(e)}")
+
+
+def run_test_shards(shards, source_root, cov, timeout):
+    # Returns the exit code of each shard, None if it was stopped at the deadline
+    with tempfile.TemporaryDirectory() as data_dir:
+        processes = []
+        try:
+            for i, shard in enumerate(shards):
+                log_path = os.path.join(data_dir, f"pytest-{i}.log")
+                process = start_test_shard(shard, source_root, data_dir, log_path)
+                processes.append((process, log_path))
+        except OSError:
+            # No Python to run pytest with, stop the shards already started
+            for process, log_path in processes:
+                process.kill()
+                process.wait()
+            raise
+
+        deadline = time.monotonic() + timeout
+        for process, log_path in processes:
+            try:
+                process.wait(timeout=max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                logging.error(f"Tests did not finish within {timeout} s, stopping")
+                break
+        exit_codes = []
+        for process, log_path in processes:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+                exit_codes.append(None)
+            else:
+                exit_codes.append(process.returncode)
+            with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+                logging.debug(f.read())
+            logging.info(f"Test process exited with code {process.returncode}")
         logging.info("Tests completed")
-    except Exception as e:
-        logging.error(f"Error running tests: {str(e)}")
-    finally:
-        cov.stop()
-        cov.save()
-        logging.info("Generating tests.html")
+
         try:
-            cov.html_report(directory="tests_html")
-            tests_html_path = os.path.join(os.getcwd(), "tests_html", "index.html")
-            logging.info(f"tests.html generated at {tests_html_path}")
-            with open(tests_html_path, "r", encoding="utf-8") as f:
-                tests_text = f.read()
+            cov.combine([data_dir], strict=False)
+            cov.save()
         except Exception as e:
-            logging.error(f"Error generating tests.html: {str(e)}")
-            tests_text = "Testrapport saknas"
-        return tests_text
+            logging.error(f"Error combining coverage data: {str(e)}")
+    return exit_codes
+
+
+def shard_problems(exit_codes, timeout):
+    # pytest exits with 0 when all tests pass and 1 when some fail, any
+    # other code means the shard did not run its tests to the end
+    lines = []
+    for i, code in enumerate(exit_codes, 1):
+        if code is None:
+            lines.append(f"Testprocess {i} avbröts efter {timeout} s")
+        elif code == 1:
+            lines.append(f"Testprocess {i}: tester misslyckades")
+        elif code != 0:
+            lines.append(f"Testprocess {i} avslutades med felkod {code}")
+    return lines
+
+
+def tests_complete(exit_codes):
+    return all(code in (0, 1) for code in exit_codes)
+
+
+def coverage_summary(cov, source_root):
+    # One line per measured file instead of the full HTML report. Like
+    # "coverage report --ignore-errors", files that are not valid Python are
+    # listed and left out instead of failing the whole report.
+    from coverage.exceptions import NotPython
+
+    lines = ["Täckning per fil (satser, missade, procent):", ""]
+    total_statements = total_missing = 0
+    for path in sorted(cov.get_data().measured_files()):
+        name = os.path.relpath(path, source_root)
+        try:
+            _, statements, _, missing, _ = cov.analysis2(path)
+        except NotPython as e:
+            logging.warning(f"Could not analyse {path}: {str(e)}")
+            lines.append(f"kunde inte analyseras: {name}")
+            continue
+        total_statements += len(statements)
+        total_missing += len(missing)
+        lines.append(
+            f"{name}: {len(statements)} satser, {len(missing)} missade, "
+            f"{coverage_percent(len(statements), len(missing))}"
+        )
+    if len(lines) == 2:
+        raise ValueError("No coverage data collected")
+    lines.append("")
+    lines.append(
+        f"Totalt: {total_statements} satser, {total_missing} missade, "
+        f"{coverage_percent(total_statements, total_missing)}"
+    )
+    return "\n".join(lines)
+
+
+def coverage_percent(statements, missing):
+    if not statements:
+        return "100%"
+    return f"{100.0 * (statements - missing) / statements:.0f}%"
+
+
+def write_coverage_html(cov, html_dir):
+    logging.info("Generating coverage HTML report")
+    try:
+        cov.html_report(directory=html_dir)
+        logging.info(f"Coverage HTML report written to {html_dir}")
+    except Exception as e:
+        logging.error(f"Error generating coverage HTML report: {str(e)}")
+
+
+def run_tests(
+    test_files=None,
+    workers=1,
+    timeout=600,
+    source_root=None,
+    use_cache=True,
+    coverage_html=False,
+):
+    import coverage
+
+    logging.info("Running tests")
+    source_root = os.path.abspath(source_root or os.getcwd())
+    if test_files is None:
+        test_files = find_test_files(source_root)
+
+    # Reuse the last report while tests, sources and interpreter are the same
+    cache_path = tests_cache_path(source_root)
+    key = tests_cache_key(source_root, test_files)
+    html_dir = os.path.join(source_root, "tests_html")
+    html_missing = coverage_html and not os.path.isdir(html_dir)
+    if use_cache and not html_missing:
+        result = load_test_result(cache_path, key)
+        if result is not None:
+            logging.info("Tests unchanged, reusing the last report")
+            return result["report"]
+
+    # Spread the test files round-robin over the worker processes
+    shards = [test_files[i :: max(workers, 1)] for i in range(max(workers, 1))]
+    shards = [shard for shard in shards if shard]
+
+    cov = coverage.Coverage(
+        data_file=os.path.join(source_root, ".coverage"), source=[source_root]
+    )
+    try:
+        exit_codes = run_test_shards(shards, source_root, cov, timeout)
+    except OSError as e:
+        logging.error(f"Could not start the tests: {str(e)}")
+        return "Testrapport saknas"
+
+    try:
+        tests_text = coverage_summary(cov, source_root)
+    except Exception as e:
+        logging.error(f"Error reading coverage data: {str(e)}")
+        return "Testrapport saknas"
+    if coverage_html:
+        write_coverage_html(cov, html_dir)
+
+    problems = shard_problems(exit_codes, timeout)
+    if problems:
+        tests_text += "\n\n" + "\n".join(problems)
+    if tests_complete(exit_codes):
+        save_test_result(cache_path, {"key": key, "report": tests_text})
+    return tests_text
 
 
 def get_system_info():
+    import platformdirs
+
     app_dirs = platformdirs.AppDirs("FileMergerApp")
     system_info = f"Operating System: {os.name}\n"
     system_info += f"Python Version: {platform.python_version()}\n"
@@ -160,6 +483,34 @@ def get_system_info():
 
 
 def extract_text_from_html(html_content):
+    from bs4 import BeautifulSoup
+
     soup = BeautifulSoup(html_content, "html.parser")
     text = soup.get_text()
     return text
+
+
+def generate_extra_info(
+    include_sphinx,
+    docs_source_root=None,
+    docs_excludes=DEFAULT_DOCS_EXCLUDES,
+    docs_builder="text",
+    test_workers=1,
+    test_timeout=600,
+    use_cache=True,
+    coverage_html=False,
+):
+    docs_text = ""
+    if include_sphinx:
+        logging.info("Generating Sphinx documentation")
+        docs_text = generate_docs(docs_source_root, docs_excludes, docs_builder)
+    logging.info("Running tests")
+    tests_text = run_tests(
+        workers=test_workers,
+        timeout=test_timeout,
+        use_cache=use_cache,
+        coverage_html=coverage_html,
+    )
+    logging.info("Getting system info")
+    system_info = get_system_info()
+    return docs_text, tests_text, system_info
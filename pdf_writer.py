@@ -0,0 +1,458 @@
+import os
+import zlib
+from collections import deque
+from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor
+from fpdf import FPDF
+from fpdf.php import UTF8ToUTF16BE
+from font_registry import attach_font
+from font_subsets import make_subset
+
+# ToUnicode CMap of every embedded TrueType font, as in FPDF._putfonts
+TO_UNICODE = (
+    "/CIDInit /ProcSet findresource begin\n"
+    "12 dict begin\n"
+    "begincmap\n"
+    "/CIDSystemInfo\n"
+    "<</Registry (Adobe)\n"
+    "/Ordering (UCS)\n"
+    "/Supplement 0\n"
+    ">> def\n"
+    "/CMapName /Adobe-Identity-UCS def\n"
+    "/CMapType 2 def\n"
+    "1 begincodespacerange\n"
+    "<0000> <FFFF>\n"
+    "endcodespacerange\n"
+    "1 beginbfrange\n"
+    "<0000> <FFFF> <0000>\n"
+    "endbfrange\n"
+    "endcmap\n"
+    "CMapName currentdict /CMap defineresource pop\n"
+    "end\n"
+    "end"
+)
+
+
+def compress_page(content, level):
+    return zlib.compress(content.encode("latin1"), level)
+
+
+class StreamingFPDF(FPDF):
+    # FPDF variant that writes each page to the output file as soon as it is
+    # closed instead of keeping the whole document in self.pages/self.buffer.
+    # Objects 1 (page tree) and 2 (resources) are reserved exactly as in FPDF
+    # and written last, together with the link annotations whose targets are
+    # only known once the document is complete.
+
+    def __init__(self, output_file_name, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.output_file_name = output_file_name
+        self.part_file_name = output_file_name + ".part"
+        self.stream = None
+        self.stream_offset = 0
+        self.page_buffer = []
+        self.page_objects = {}
+        self.page_annots = {}
+        self.deferred_pages = {}
+        # Optional callback(page) run after each page has been written
+        self.on_page_closed = None
+        self.width_tables = {}
+        # Optional font_subsets.SubsetCache for the embedded TrueType subsets
+        self.subset_cache = None
+        # zlib level for page content and the number of threads compressing it
+        self.compress_level = 6
+        self.compress_workers = 1
+        self.compress_executor = None
+        self.pending_pages = deque()
+
+    def open(self):
+        super().open()
+        if self.stream is None:
+            self.stream = open(self.part_file_name, "wb")
+            self.stream_offset = 0
+            self._putheader()
+
+    def output(self, name="", dest=""):
+        if name and os.path.abspath(name) != os.path.abspath(self.output_file_name):
+            self.error(f"Streaming output is bound to {self.output_file_name}")
+        if self.state < 3:
+            self.close()
+        return ""
+
+    def discard(self):
+        # Drop a half-written document, e.g. after an error or cancellation
+        self._shutdown_compression(cancel=True)
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if os.path.exists(self.part_file_name):
+            os.remove(self.part_file_name)
+        self.state = 3
+
+    def add_font(self, family, style="", fname="", uni=False):
+        # TrueType fonts come from the process-wide registry, so only the
+        # first document in a process reads and parses them
+        if uni:
+            attach_font(self, family, style, fname)
+        else:
+            super().add_font(family, style, fname, uni)
+
+    def get_string_width(self, s):
+        table = self.width_tables.get(self.current_font.get("fontkey"))
+        if table is None:
+            return super().get_string_width(s)
+        return table.string_width(s) * self.font_size / 1000.0
+
+    def _out(self, s):
+        if self.state == 2:
+            if isinstance(s, bytes):
+                s = s.decode("latin1")
+            elif not isinstance(s, str):
+                s = str(s)
+            self.page_buffer.append(s)
+            self.page_buffer.append("\n")
+            return
+        if isinstance(s, str):
+            data = s.encode("latin1")
+        elif isinstance(s, bytes):
+            data = s
+        else:
+            data = str(s).encode("latin1")
+        self.stream.write(data)
+        self.stream.write(b"\n")
+        self.stream_offset += len(data) + 1
+
+    def _newobj(self):
+        self.n += 1
+        self._beginobj(self.n)
+
+    def _beginobj(self, n):
+        self.offsets[n] = self.stream_offset
+        self._out(str(n) + " 0 obj")
+
+    def _reserveobj(self):
+        self.n += 1
+        return self.n
+
+    def _beginpage(self, orientation):
+        super()._beginpage(orientation)
+        self.page_buffer = []
+
+    def _endpage(self):
+        super()._endpage()
+        self._flushpage(self.page)
+        if self.on_page_closed:
+            self.on_page_closed(self.page)
+
+    def _flushpage(self, n):
+        content = "".join(self.page_buffer)
+        self.page_buffer = []
+        self.pages[n] = ""
+
+        # Characters used on the page are appended to the font subset once per
+        # occurrence; keep only the first occurrence so the list stays small.
+        for font in self.fonts.values():
+            if "subset" in font:
+                font["subset"][:] = dict.fromkeys(font["subset"])
+
+        page_obj = self._reserveobj()
+        content_obj = self._reserveobj()
+        self.page_objects[n] = page_obj
+        annots_obj = None
+        if n in self.page_links:
+            annots_obj = self._reserveobj()
+            self.page_annots[n] = annots_obj
+
+        if self._has_nb_alias(content):
+            # The total page count is not known yet
+            self.deferred_pages[n] = (content_obj, content)
+            content = None
+        self._putpage((n, page_obj, annots_obj, content_obj), content)
+
+    def _has_nb_alias(self, content):
+        alias = getattr(self, "str_alias_nb_pages", None)
+        if not alias:
+            return False
+        return alias in content or UTF8ToUTF16BE(alias, False) in content
+
+    def _putpage(self, page, content):
+        if not self.compress or self.compress_workers <= 1:
+            self._putpageobj(*page)
+            if content is not None:
+                self._putpagecontent(page[3], self._pagestream(content))
+            return
+        # zlib releases the GIL, so pages are compressed in threads while
+        # the next ones are laid out. A page is written together with its
+        # stream, in page order, once more than two pages per thread wait.
+        # That keeps memory bounded and the file identical to one thread.
+        future = None
+        if content is not None:
+            future = self._compress_executor().submit(
+                compress_page, content, self.compress_level
+            )
+        self.pending_pages.append((page, future))
+        self._putqueuedpages()
+
+    def _putqueuedpages(self, wait=False):
+        pending = self.pending_pages
+        while pending and (wait or len(pending) > 2 * self.compress_workers):
+            page, future = pending.popleft()
+            self._putpageobj(*page)
+            if future is not None:
+                self._putpagecontent(page[3], future.result())
+
+    def _putpageobj(self, n, page_obj, annots_obj, content_obj):
+        w_pt, h_pt = self._default_page_size()
+        self._beginobj(page_obj)
+        self._out("<</Type /Page")
+        self._out("/Parent 1 0 R")
+        if n in self.orientation_changes:
+            self._out("/MediaBox [0 0 %.2f %.2f]" % (h_pt, w_pt))
+        self._out("/Resources 2 0 R")
+        if annots_obj:
+            self._out(f"/Annots {annots_obj} 0 R")
+        if self.pdf_version > "1.3":
+            self._out("/Group <</Type /Group /S /Transparency /CS /DeviceRGB>>")
+        self._out(f"/Contents {content_obj} 0 R>>")
+        self._out("endobj")
+
+    def _pagestream(self, content):
+        if self.compress:
+            return compress_page(content, self.compress_level)
+        return content.encode("latin1")
+
+    def _pagestreams(self, contents):
+        # Streams of several pages, in order, compressed in parallel if set up
+        if self.compress and self.compress_workers > 1:
+            return self._compress_executor().map(
+                compress_page, contents, repeat(self.compress_level)
+            )
+        return map(self._pagestream, contents)
+
+    def _putpagecontent(self, obj, p):
+        filter = "/Filter /FlateDecode " if self.compress else ""
+        self._beginobj(obj)
+        self._out("<<" + filter + "/Length " + str(len(p)) + ">>")
+        self._putstream(p)
+        self._out("endobj")
+
+    def _compress_executor(self):
+        if self.compress_executor is None:
+            self.compress_executor = ThreadPoolExecutor(
+                max_workers=self.compress_workers, thread_name_prefix="pdf-compress"
+            )
+        return self.compress_executor
+
+    def _shutdown_compression(self, cancel=False):
+        if self.compress_executor is not None:
+            self.compress_executor.shutdown(cancel_futures=cancel)
+            self.compress_executor = None
+        self.pending_pages.clear()
+
+    def _default_page_size(self):
+        if self.def_orientation == "P":
+            return self.fw_pt, self.fh_pt
+        return self.fh_pt, self.fw_pt
+
+    def _putpages(self):
+        nb = self.page
+        alias = getattr(self, "str_alias_nb_pages", None)
+        self._putqueuedpages(wait=True)
+        objs = [obj for obj, content in self.deferred_pages.values()]
+        contents = [
+            content.replace(
+                UTF8ToUTF16BE(alias, False), UTF8ToUTF16BE(str(nb), False)
+            ).replace(alias, str(nb))
+            for obj, content in self.deferred_pages.values()
+        ]
+        for obj, p in zip(objs, self._pagestreams(contents)):
+            self._putpagecontent(obj, p)
+        self.deferred_pages = {}
+        self._shutdown_compression()
+
+        w_pt, h_pt = self._default_page_size()
+        for n, annots_obj in self.page_annots.items():
+            annots = "["
+            for pl in self.page_links[n]:
+                rect = "%.2f %.2f %.2f %.2f" % (
+                    pl[0],
+                    pl[1],
+                    pl[0] + pl[2],
+                    pl[1] - pl[3],
+                )
+                annots += (
+                    "<</Type /Annot /Subtype /Link /Rect ["
+                    + rect
+                    + "] /Border [0 0 0] "
+                )
+                if isinstance(pl[4], str):
+                    annots += "/A <</S /URI /URI " + self._textstring(pl[4]) + ">>>>"
+                else:
+                    link = self.links[pl[4]]
+                    h = w_pt if link[0] in self.orientation_changes else h_pt
+                    annots += "/Dest [%d 0 R /XYZ 0 %.2f null]>>" % (
+                        self.page_objects.get(link[0], 1),
+                        h - link[1] * self.k,
+                    )
+            self._beginobj(annots_obj)
+            self._out(annots + "]")
+            self._out("endobj")
+
+        # Pages root
+        self._beginobj(1)
+        self._out("<</Type /Pages")
+        kids = "/Kids ["
+        for n in range(1, nb + 1):
+            kids += str(self.page_objects[n]) + " 0 R "
+        self._out(kids + "]")
+        self._out("/Count " + str(nb))
+        self._out("/MediaBox [0 0 %.2f %.2f]" % (w_pt, h_pt))
+        self._out(">>")
+        self._out("endobj")
+
+    def _putresources(self):
+        self._putfonts()
+        self._putimages()
+        # Resource dictionary
+        self._beginobj(2)
+        self._out("<<")
+        self._putresourcedict()
+        self._out(">>")
+        self._out("endobj")
+
+    def _putfonts(self):
+        # FPDF writes core and Type1 fonts; TrueType fonts are embedded here
+        # from a cached subset instead of TTFontFile.makeSubset on every run
+        fonts = self.fonts
+        self.fonts = {k: font for k, font in fonts.items() if font["type"] != "TTF"}
+        try:
+            super()._putfonts()
+        finally:
+            self.fonts = fonts
+        for font in sorted(fonts.values(), key=lambda font: font["i"]):
+            if font["type"] == "TTF":
+                self._putttfont(font)
+
+    def _putttfont(self, font):
+        # Code point 0 is a placeholder at the start of every subset list
+        codes = font["subset"][1:]
+        if self.subset_cache is not None:
+            subset = self.subset_cache.subset(font["ttffile"], codes)
+        else:
+            subset = make_subset(font["ttffile"], sorted(set(codes)))
+        font["n"] = self.n + 1
+        fontname = "MPDFAA+" + font["name"]
+
+        # Type0 font
+        self._newobj()
+        self._out("<</Type /Font")
+        self._out("/Subtype /Type0")
+        self._out("/BaseFont /" + fontname)
+        self._out("/Encoding /Identity-H")
+        self._out(f"/DescendantFonts [{self.n + 1} 0 R]")
+        self._out(f"/ToUnicode {self.n + 2} 0 R")
+        self._out(">>")
+        self._out("endobj")
+
+        # CIDFontType2
+        self._newobj()
+        self._out("<</Type /Font")
+        self._out("/Subtype /CIDFontType2")
+        self._out("/BaseFont /" + fontname)
+        self._out(f"/CIDSystemInfo {self.n + 2} 0 R")
+        self._out(f"/FontDescriptor {self.n + 3} 0 R")
+        if font["desc"].get("MissingWidth"):
+            self._out("/DW %d" % font["desc"]["MissingWidth"])
+        self._putTTfontwidths(font, subset.max_uni)
+        self._out(f"/CIDToGIDMap {self.n + 4} 0 R")
+        self._out(">>")
+        self._out("endobj")
+
+        # ToUnicode
+        self._newobj()
+        self._out("<</Length " + str(len(TO_UNICODE)) + ">>")
+        self._putstream(TO_UNICODE)
+        self._out("endobj")
+
+        # CIDSystemInfo
+        self._newobj()
+        self._out("<</Registry (Adobe)")
+        self._out("/Ordering (UCS)")
+        self._out("/Supplement 0")
+        self._out(">>")
+        self._out("endobj")
+
+        # Font descriptor
+        self._newobj()
+        self._out("<</Type /FontDescriptor")
+        self._out("/FontName /" + fontname)
+        for key in (
+            "Ascent",
+            "Descent",
+            "CapHeight",
+            "Flags",
+            "FontBBox",
+            "ItalicAngle",
+            "StemV",
+            "MissingWidth",
+        ):
+            value = font["desc"][key]
+            if key == "Flags":
+                # Nonsymbolic
+                value = (value | 4) & ~32
+            self._out(" /%s %s" % (key, value))
+        self._out(f"/FontFile2 {self.n + 2} 0 R")
+        self._out(">>")
+        self._out("endobj")
+
+        # CIDToGIDMap
+        self._newobj()
+        self._out("<</Length " + str(len(subset.cid_to_gid)))
+        self._out("/Filter /FlateDecode")
+        self._out(">>")
+        self._putstream(subset.cid_to_gid)
+        self._out("endobj")
+
+        # Font file
+        self._newobj()
+        self._out("<</Length " + str(len(subset.stream)))
+        self._out("/Filter /FlateDecode")
+        self._out("/Length1 " + str(subset.length))
+        self._out(">>")
+        self._putstream(subset.stream)
+        self._out("endobj")
+
+    def _enddoc(self):
+        self._putpages()
+        self._putresources()
+        # Info
+        self._newobj()
+        self._out("<<")
+        self._putinfo()
+        self._out(">>")
+        self._out("endobj")
+        # Catalog
+        self._newobj()
+        self._out("<<")
+        self._putcatalog()
+        self._out(">>")
+        self._out("endobj")
+        # Cross-ref
+        o = self.stream_offset
+        self._out("xref")
+        self._out("0 " + str(self.n + 1))
+        self._out("0000000000 65535 f ")
+        for i in range(1, self.n + 1):
+            self._out("%010d 00000 n " % self.offsets[i])
+        # Trailer
+        self._out("trailer")
+        self._out("<<")
+        self._puttrailer()
+        self._out(">>")
+        self._out("startxref")
+        self._out(o)
+        self._out("%%EOF")
+        self.stream.close()
+        self.stream = None
+        os.replace(self.part_file_name, self.output_file_name)
+        self.state = 3
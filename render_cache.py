@@ -0,0 +1,80 @@
+import os
+import hashlib
+import logging
+from cache_files import default_cache_dir, load_pickle, store_pickle, touch, prune_dir
+
+# Bump when the layout format or the wrapping rules change
+LAYOUT_VERSION = 2
+
+# Size the cache is pruned back to after a merge, least recently used first
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+
+
+def file_digest(file, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stat_signature(file):
+    try:
+        stat = os.stat(file)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def content_signature(file):
+    if file.endswith(".db"):
+        # Hashing a whole database costs as much as reading it, its size and
+        # modification time change on every write instead. Committed rows
+        # stay in the -wal file until a checkpoint, so it is part of the key.
+        return stat_signature(file), stat_signature(file + "-wal")
+    return file_digest(file)
+
+
+class RenderCache:
+    # Laid-out runs for one input file, stored under a key built from the
+    # file content and everything that affects the layout.
+
+    def __init__(self, cache_dir=None, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir or default_cache_dir("render")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, file, *layout_params):
+        digest = hashlib.sha256()
+        digest.update(repr(content_signature(file)).encode("ascii"))
+        for param in (LAYOUT_VERSION,) + layout_params:
+            digest.update(b"\0" + repr(param).encode("utf-8"))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".pkl")
+
+    def contains(self, key):
+        return os.path.exists(self.path(key))
+
+    def get(self, key):
+        path = self.path(key)
+        runs = load_pickle(path)
+        if runs is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            touch(path)
+        return runs
+
+    def put(self, key, runs):
+        try:
+            store_pickle(self.path(key), runs)
+        except OSError as e:
+            logging.warning(f"Kunde inte skriva cachepost {key}: {str(e)}")
+
+    def prune(self):
+        removed = prune_dir(self.cache_dir, self.max_bytes)
+        if removed:
+            logging.info(f"Renderingscache: {removed} gamla poster borttagna")
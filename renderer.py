@@ -0,0 +1,565 @@
+import os
+import logging
+from itertools import chain
+from collections import deque, namedtuple
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
+from pdf_writer import StreamingFPDF
+from font_registry import preload_fonts as preload_registry
+from textlayout import LineWrapper
+from render_cache import RenderCache
+from font_subsets import SubsetCache
+from dbsummary import summarize_database, summarize_databases
+from logreader import select_lines, collapse_repeats
+
+FONT_DIR = os.path.dirname(os.path.abspath(__file__))
+FONT_FILE = os.path.join(FONT_DIR, "DejaVuSansCondensed.ttf")
+FONT_FILE_BOLD = os.path.join(FONT_DIR, "DejaVuSansCondensed-Bold.ttf")
+FONTS = (("DejaVu", "", FONT_FILE), ("DejaVu", "B", FONT_FILE_BOLD))
+
+
+def preload_fonts():
+    preload_registry(FONTS)
+
+
+def create_pdf(
+    output_file_name, subset_cache=None, compress_level=6, compress_workers=1
+):
+    if not os.path.exists(FONT_FILE) or not os.path.exists(FONT_FILE_BOLD):
+        raise FileNotFoundError(
+            "Kunde inte hitta nödvändiga fontfiler. PDF-generering avbruten."
+        )
+
+    pdf = StreamingFPDF(output_file_name)
+    pdf.subset_cache = subset_cache
+    pdf.compress_level = compress_level
+    pdf.compress_workers = compress_workers
+    for family, style, font_file in FONTS:
+        pdf.add_font(family, style, font_file, uni=True)
+    pdf.set_font("DejaVu", "", 12)
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.set_margins(left=20, top=20, right=20)
+    pdf.alias_nb_pages()
+    return pdf
+
+
+def add_section(pdf, title, link):
+    pdf.add_page()
+    pdf.set_font("DejaVu", "B", 16)
+    pdf.cell(0, 10, title, ln=True, align="L")
+    pdf.ln(5)
+    pdf.set_link(link)
+
+
+# A laid-out file section is a list of runs (style, height, text). Text runs
+# use the DejaVu face given by style; LINE_BREAK and PAGE_BREAK runs move the
+# cursor without printing anything.
+LINE_BREAK = "ln"
+PAGE_BREAK = "page"
+
+# File types that get their own section in the PDF
+SECTION_EXTENSIONS = (".py", ".db", ".log")
+
+# Logs this large are streamed into the PDF line by line instead of being
+# laid out whole, cached and sent through the layout pool
+STREAM_LOG_BYTES = 4 * 1024 * 1024
+
+# Settings besides the wrapper that change how a file is laid out. They are
+# part of the render cache key, so every field must have a stable repr.
+LayoutOptions = namedtuple(
+    "LayoutOptions",
+    [
+        "row_counts",
+        "db_immutable",
+        "db_preview",
+        "log_head",
+        "log_tail",
+        "log_since",
+        "log_until",
+        "log_collapse",
+    ],
+    defaults=["exact", False, None, None, None, None, None, None],
+)
+
+
+def file_heading_runs(file):
+    return [
+        ("B", 10, f"Filsökväg: {file}"),
+        ("B", 10, f"Filnamn: {os.path.basename(file)}"),
+        (LINE_BREAK, 5, ""),
+    ]
+
+
+def end_file_runs(new_page):
+    if new_page:
+        return [(PAGE_BREAK, 0, "")]
+    return [(LINE_BREAK, 5, "")]
+
+
+def text_runs(wrapper, lines, h=6):
+    return [("", h, part) for line in lines for part in wrapper.wrap(line)]
+
+
+def emit_runs(pdf, runs):
+    w = pdf.w - pdf.r_margin - pdf.l_margin
+    for style, h, text in runs:
+        if style == LINE_BREAK:
+            pdf.ln(h)
+        elif style == PAGE_BREAK:
+            pdf.add_page()
+        else:
+            pdf.set_font("DejaVu", style, 12)
+            pdf.cell(w, h, text, ln=1, align="L")
+    pdf.set_font("DejaVu", "", 12)
+
+
+def write_text(pdf, text, h=6):
+    emit_runs(pdf, text_runs(LineWrapper.from_pdf(pdf), text.split("\n"), h))
+
+
+def read_text_file(file, errors="replace"):
+    with open(file, "r", encoding="utf-8", errors=errors) as f:
+        return f.read().split("\n")
+
+
+def table_runs(tables, wrapper=None):
+    wrap = wrapper.wrap if wrapper else lambda line: [line]
+    if not tables:
+        return [("", 10, "Databasen är tom."), (LINE_BREAK, 5, "")]
+
+    runs = []
+    for table in tables:
+        runs.append(("B", 10, f"Tabell: {table.name}"))
+        for name, column_type in table.columns:
+            runs.append(("", 10, f"  Kolumn: {name}, Typ: {column_type}"))
+        prefix = "ca. " if table.approximate else ""
+        runs.append(("", 10, f"  Antal rader: {prefix}{table.row_count}"))
+        if table.preview:
+            # Wrapped with the regular font's widths, so it is not set in bold
+            header = "  " + " | ".join(name for name, column_type in table.columns)
+            runs.extend(("", 10, part) for part in wrap(header))
+            for row in table.preview:
+                runs.extend(("", 10, part) for part in wrap("  " + " | ".join(row)))
+        if table.preview_truncated:
+            runs.append(("", 10, "  … förhandsvisningen är avkortad"))
+        runs.append((LINE_BREAK, 5, ""))
+    return runs
+
+
+def database_runs(file, options=None, wrapper=None):
+    options = options or LayoutOptions()
+    tables = summarize_database(
+        file, options.row_counts, options.db_immutable, options.db_preview
+    )
+    return table_runs(tables, wrapper)
+
+
+def summary_runs(summary, wrapper=None):
+    if summary.error is not None:
+        raise summary.error
+    return table_runs(summary.tables, wrapper)
+
+
+def database_error_runs(error, on_error=None):
+    logging.error(f"Fel vid läsning av databasen: {str(error)}")
+    if on_error:
+        on_error(f"Ett fel uppstod vid läsning av databasen: {str(error)}")
+    return [(LINE_BREAK, 5, "")]
+
+
+def print_database_info(pdf, file, on_error=None, options=None):
+    try:
+        runs = database_runs(file, options, LineWrapper.from_pdf(pdf))
+    except Exception as e:
+        runs = database_error_runs(e, on_error)
+    emit_runs(pdf, runs)
+
+
+def log_selection_runs(options):
+    parts = []
+    if options.log_since:
+        parts.append(f"från {options.log_since}")
+    if options.log_until:
+        parts.append(f"till {options.log_until}")
+    if options.log_tail:
+        parts.append(f"sista {options.log_tail} raderna")
+    if options.log_head:
+        parts.append(f"första {options.log_head} raderna")
+    if options.log_collapse:
+        parts.append("upprepade rader sammanslagna")
+    if not parts:
+        return []
+    return [("B", 10, f"Urval: {', '.join(parts)}"), (LINE_BREAK, 5, "")]
+
+
+def log_runs(file, wrapper, options):
+    # Lazy like select_lines, only the current line is held in memory
+    lines = select_lines(
+        file,
+        options.log_head,
+        options.log_tail,
+        options.log_since,
+        options.log_until,
+    )
+    if options.log_collapse:
+        lines = collapse_repeats(lines, options.log_collapse)
+    yield from log_selection_runs(options)
+    for line in lines:
+        for part in wrapper.wrap(line):
+            yield ("", 6, part)
+    yield (LINE_BREAK, 5, "")
+
+
+def streams_log(file, options):
+    if not file.endswith(".log"):
+        return False
+    # A selection only reads part of the log, hashing all of it for the cache
+    # key would cost more than laying the selection out again
+    if options.log_head or options.log_tail or options.log_since or options.log_until:
+        return True
+    return os.path.getsize(file) >= STREAM_LOG_BYTES
+
+
+def layout_file_body(file, wrapper, options=None):
+    options = options or LayoutOptions()
+    if file.endswith(".db"):
+        return database_runs(file, options, wrapper)
+    if file.endswith(".log"):
+        return list(log_runs(file, wrapper, options))
+    lines = read_text_file(file)
+    return text_runs(wrapper, lines) + [(LINE_BREAK, 5, "")]
+
+
+def cache_key(cache, file, wrapper, options):
+    if cache is None:
+        return None
+    return cache.key(file, *wrapper.layout_params(), options)
+
+
+def lookup_cache(cache, file, wrapper, options):
+    key = cache_key(cache, file, wrapper, options)
+    if key is None:
+        return None, None
+    return key, cache.get(key)
+
+
+def finish_layout(file, compute, cache=None, key=None, on_error=None):
+    try:
+        runs = compute()
+    except Exception as e:
+        if not file.endswith(".db"):
+            raise
+        return database_error_runs(e, on_error)
+    if key is not None:
+        cache.put(key, runs)
+    return runs
+
+
+def layout_file(file, wrapper, cache=None, on_error=None, options=None):
+    options = options or LayoutOptions()
+    if streams_log(file, options):
+        return log_runs(file, wrapper, options)
+    key, runs = lookup_cache(cache, file, wrapper, options)
+    if runs is None:
+        runs = finish_layout(
+            file,
+            lambda: layout_file_body(file, wrapper, options),
+            cache,
+            key,
+            on_error,
+        )
+    return runs
+
+
+_worker_wrapper = None
+_worker_options = None
+
+
+def _init_layout_worker(wrapper, options):
+    global _worker_wrapper, _worker_options
+    _worker_wrapper = wrapper
+    _worker_options = options
+
+
+def _layout_in_worker(file):
+    return layout_file_body(file, _worker_wrapper, _worker_options)
+
+
+def layout_files(files, wrapper, cache=None, on_error=None, workers=1, options=None):
+    # Yields (file, runs) in input order. With more than one worker the files
+    # missing from the cache are laid out in a process pool, a few files ahead
+    # of the one currently being written to the PDF.
+    options = options or LayoutOptions()
+    if workers <= 1:
+        for file in files:
+            yield file, layout_file(file, wrapper, cache, on_error, options)
+        return
+
+    # Every process starts an interpreter and imports fpdf, so the pool gets
+    # no more processes than there are files missing from the cache. Streamed
+    # logs are neither looked up nor sent to the pool.
+    looked_up = []
+    for file in files:
+        streamed = streams_log(file, options)
+        key = None if streamed else cache_key(cache, file, wrapper, options)
+        looked_up.append((file, streamed, key))
+    missing = sum(
+        1
+        for file, streamed, key in looked_up
+        if not streamed and (key is None or not cache.contains(key))
+    )
+    pool_size = max(1, min(workers, missing))
+    executor = None
+    pending = deque()
+    remaining = iter(looked_up)
+
+    def fill():
+        nonlocal executor
+        while len(pending) < workers * 4:
+            file, streamed, key = next(remaining, (None, False, None))
+            if file is None:
+                return
+            runs = cache.get(key) if key is not None else None
+            future = None
+            if runs is None and not streamed:
+                if executor is None:
+                    executor = ProcessPoolExecutor(
+                        max_workers=pool_size,
+                        initializer=_init_layout_worker,
+                        initargs=(wrapper, options),
+                    )
+                future = executor.submit(_layout_in_worker, file)
+            pending.append((file, streamed, key, runs, future))
+
+    try:
+        fill()
+        while pending:
+            file, streamed, key, runs, future = pending.popleft()
+            fill()
+            if streamed:
+                runs = log_runs(file, wrapper, options)
+            elif future is not None:
+                runs = finish_layout(file, future.result, cache, key, on_error)
+            yield file, runs
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def layout_database_files(
+    files, wrapper, cache=None, on_error=None, workers=1, options=None
+):
+    # Like layout_files, but the databases missing from the cache are read
+    # in a thread pool and only turned into runs here, in input order.
+    options = options or LayoutOptions()
+    looked_up = [
+        (file,) + lookup_cache(cache, file, wrapper, options) for file in files
+    ]
+    missing = [file for file, key, runs in looked_up if runs is None]
+    summaries = summarize_databases(
+        missing,
+        options.row_counts,
+        options.db_immutable,
+        workers,
+        preview=options.db_preview,
+    )
+    with closing(summaries):
+        for file, key, runs in looked_up:
+            if runs is None:
+                summary = next(summaries)
+                runs = finish_layout(
+                    file,
+                    lambda: summary_runs(summary, wrapper),
+                    cache,
+                    key,
+                    on_error,
+                )
+            yield file, runs
+
+
+class RenderCancelled(Exception):
+    pass
+
+
+class RenderProgress:
+    # Reports finished files and stops the render when cancellation has been
+    # requested. Checked between files and whenever a page is closed.
+
+    def __init__(self, total, progress=None, is_cancelled=None):
+        self.total = total
+        self.done = 0
+        self.progress = progress
+        self.is_cancelled = is_cancelled
+
+    def check(self):
+        if self.is_cancelled and self.is_cancelled():
+            raise RenderCancelled("Sammanslagningen avbröts.")
+
+    def file_done(self, file):
+        self.done += 1
+        if self.progress:
+            self.progress(self.done, self.total, file)
+
+
+def write_files(
+    pdf,
+    files,
+    new_page=False,
+    cache=None,
+    on_error=None,
+    workers=1,
+    tracker=None,
+    options=None,
+    layout=layout_files,
+):
+    pdf.set_font("DejaVu", "", 12)
+    wrapper = LineWrapper.from_pdf(pdf)
+    laid_out = layout(files, wrapper, cache, on_error, workers, options)
+    with closing(laid_out):
+        for file, runs in laid_out:
+            if tracker:
+                tracker.check()
+            emit_runs(
+                pdf, chain(file_heading_runs(file), runs, end_file_runs(new_page))
+            )
+            if tracker:
+                tracker.file_done(file)
+
+
+def render_pdf(
+    files,
+    output_file_name,
+    docs_text,
+    tests_text,
+    system_info,
+    new_page=False,
+    include_sphinx=False,
+    on_error=None,
+    use_cache=True,
+    workers=1,
+    progress=None,
+    is_cancelled=None,
+    options=None,
+    compress_level=6,
+):
+    if not output_file_name.endswith(".pdf"):
+        raise ValueError("Endast PDF-format stöds för närvarande.")
+
+    logging.info("Generating PDF file")
+    cache = RenderCache() if use_cache else None
+    tracker = RenderProgress(
+        len([file for file in files if file.endswith(SECTION_EXTENSIONS)]),
+        progress,
+        is_cancelled,
+    )
+    tracker.check()
+    pdf = create_pdf(
+        output_file_name,
+        SubsetCache() if use_cache else None,
+        compress_level=compress_level,
+        compress_workers=workers,
+    )
+    pdf.on_page_closed = lambda page: tracker.check()
+    try:
+        write_document(
+            pdf,
+            files,
+            docs_text,
+            tests_text,
+            system_info,
+            new_page=new_page,
+            include_sphinx=include_sphinx,
+            on_error=on_error,
+            cache=cache,
+            workers=workers,
+            tracker=tracker,
+            options=options,
+        )
+        pdf.output(output_file_name)
+    except BaseException:
+        pdf.discard()
+        raise
+    if cache is not None:
+        logging.info(f"Renderingscache: {cache.hits} träffar, {cache.misses} missar")
+        cache.prune()
+    logging.info(f"Sammanslagen fil skapad: {output_file_name}")
+    return output_file_name
+
+
+def write_document(
+    pdf,
+    files,
+    docs_text,
+    tests_text,
+    system_info,
+    new_page=False,
+    include_sphinx=False,
+    on_error=None,
+    cache=None,
+    workers=1,
+    tracker=None,
+    options=None,
+):
+    # Lägg till separata sidor för varje sektion
+    pdf.add_page()
+    pdf.set_font("DejaVu", "B", 16)
+    pdf.cell(0, 10, "Innehållsförteckning", ln=True, align="C")
+    pdf.ln(10)
+
+    bookmarks = {}
+    for title in (
+        "Sphinx-dokumentation",
+        "Systeminformation",
+        "Testrapport",
+        "Python-filer",
+        "Databasfiler",
+        "Loggfiler",
+    ):
+        bookmarks[title] = pdf.add_link()
+        pdf.cell(0, 10, title, link=bookmarks[title])
+        pdf.ln()
+
+    # Sphinx-dokumentation
+    add_section(pdf, "Sphinx-dokumentation", bookmarks["Sphinx-dokumentation"])
+    pdf.set_font("DejaVu", "", 12)
+    if include_sphinx:
+        write_text(pdf, docs_text)
+
+    # Systeminformation
+    add_section(pdf, "Systeminformation", bookmarks["Systeminformation"])
+    pdf.set_font("DejaVu", "", 12)
+    write_text(pdf, system_info)
+
+    # Testrapport
+    add_section(pdf, "Testrapport", bookmarks["Testrapport"])
+    pdf.set_font("DejaVu", "", 12)
+    write_text(pdf, tests_text)
+
+    # Python-filer
+    add_section(pdf, "Python-filer", bookmarks["Python-filer"])
+    python_files = [file for file in files if file.endswith(".py")]
+    write_files(
+        pdf, python_files, new_page, cache, on_error, workers, tracker, options
+    )
+
+    # Databasfiler
+    add_section(pdf, "Databasfiler", bookmarks["Databasfiler"])
+    database_files = [file for file in files if file.endswith(".db")]
+    write_files(
+        pdf,
+        database_files,
+        new_page,
+        cache,
+        on_error,
+        workers,
+        tracker,
+        options,
+        layout=layout_database_files,
+    )
+
+    # Loggfiler
+    add_section(pdf, "Loggfiler", bookmarks["Loggfiler"])
+    log_files = [file for file in files if file.endswith(".log")]
+    write_files(
+        pdf, log_files, new_page, cache, on_error, workers, tracker, options
+    )
@@ -0,0 +1,119 @@
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+# Modules that should only be loaded once the stage that needs them runs
+HEAVY_MODULES = ("sphinx", "coverage", "pytest", "bs4", "platformdirs")
+
+
+def import_times(module, python=sys.executable):
+    # Imports module in a fresh interpreter with -X importtime and returns
+    # {name: (self_us, cumulative_us)} for every module that was loaded.
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} misslyckades:\n{result.stderr}")
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        times[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    return times
+
+
+def median_times(module, runs, python=sys.executable):
+    samples = [import_times(module, python) for _ in range(runs)]
+    names = set().union(*samples)
+    return {
+        name: tuple(
+            statistics.median(sample[name][i] for sample in samples if name in sample)
+            for i in range(2)
+        )
+        for name in names
+    }
+
+
+def format_report(module, times, top):
+    total = times.get(module, (0, 0))[1]
+    lines = [f"Importtid för {module}: {total / 1000:.1f} ms ({len(times)} moduler)"]
+    lines.append("")
+    lines.append(f"{'kumulativ ms':>12} {'egen ms':>8}  modul")
+    ranked = sorted(times.items(), key=lambda item: item[1][1], reverse=True)
+    for name, (self_us, cumulative_us) in ranked[:top]:
+        lines.append(f"{cumulative_us / 1000:12.1f} {self_us / 1000:8.1f}  {name}")
+    loaded = [
+        name
+        for name in HEAVY_MODULES
+        if any(n == name or n.startswith(name + ".") for n in times)
+    ]
+    lines.append("")
+    lines.append(f"Tunga moduler som laddas vid start: {', '.join(loaded) or 'inga'}")
+    return "\n".join(lines)
+
+
+def write_times(path, times):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("modul\tegen_us\tkumulativ_us\n")
+        for name, (self_us, cumulative_us) in sorted(times.items()):
+            f.write(f"{name}\t{self_us:.0f}\t{cumulative_us:.0f}\n")
+
+
+def launch_time(command):
+    start = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def compare_executables(executables, runs):
+    # Starts each build with --exit-after-start, alternating between them so
+    # disk and network caching affects all builds the same way.
+    samples = {exe: [] for exe in executables}
+    for _ in range(runs):
+        for exe in executables:
+            samples[exe].append(launch_time([exe, "--exit-after-start"]))
+    lines = [f"{'median s':>9} {'min s':>7}  program"]
+    for exe, times in samples.items():
+        lines.append(f"{statistics.median(times):9.2f} {min(times):7.2f}  {exe}")
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Mät importtid per modul vid start (som python -X importtime)"
+    )
+    parser.add_argument(
+        "--module", default="gui", help="Modul som importeras (standard: gui)"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=5, help="Antal körningar, medianen visas"
+    )
+    parser.add_argument(
+        "--top", type=int, default=25, help="Antal långsammaste moduler som visas"
+    )
+    parser.add_argument("--python", default=sys.executable, help="Python att mäta")
+    parser.add_argument("--out", help="Skriv alla importtider som TSV till filen")
+    parser.add_argument(
+        "--exe",
+        nargs="+",
+        help="Jämför starttiden för byggda merge.exe (t.ex. onefile och onedir)",
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.exe:
+        print(compare_executables(args.exe, max(args.runs, 1)))
+        sys.exit(0)
+    times = median_times(args.module, max(args.runs, 1), args.python)
+    print(format_report(args.module, times, args.top))
+    if args.out:
+        write_times(args.out, times)
@@ -87,3 +87,858 @@ def test_print_database_info(app, mocker):
     pdf_mock.ln.assert_called()
 
     os.remove("test.db")
+
+
+def test_run_batch_creates_pdf(tmp_path, mocker):
+    import merge
+
+    source = tmp_path / "example.py"
+    source.write_text("print('hej')\n", encoding="utf-8")
+    output = tmp_path / "report.pdf"
+    mocker.patch(
+        "merger_utils.generate_extra_info",
+        return_value=("", "Testrapport saknas", "Operating System: test"),
+    )
+
+    exit_code = merge.run_batch(
+        [str(source)], str(output), new_page=True, use_cache=False
+    )
+
+    assert exit_code == 0
+    assert output.read_bytes().startswith(b"%PDF")
+
+
+def test_streaming_pdf_writes_pages_incrementally(tmp_path):
+    from pdf_writer import StreamingFPDF
+
+    output = tmp_path / "stream.pdf"
+    pdf = StreamingFPDF(str(output))
+    pdf.set_font("Arial", "", 12)
+    pdf.add_page()
+    link = pdf.add_link()
+    pdf.cell(0, 10, "Till sida 2", link=link)
+    pdf.add_page()
+    pdf.set_link(link)
+    pdf.cell(0, 10, "Sida 2")
+    pdf.add_page()
+
+    assert len(pdf.page_objects) == 2 and pdf.stream_offset > 0
+    pdf.output(str(output))
+
+    data = output.read_bytes()
+    assert data.startswith(b"%PDF") and data.rstrip().endswith(b"%%EOF")
+    assert b"/Count 3" in data
+    assert not os.path.exists(str(output) + ".part")
+
+
+def test_line_wrapper_matches_multi_cell():
+    from textlayout import LineWrapper
+
+    pdf = FPDF()
+    pdf.set_font("Arial", "", 12)
+    pdf.add_page()
+    pdf.add_font("DejaVu", "", "DejaVuSansCondensed.ttf", uni=True)
+    pdf.set_font("DejaVu", "", 12)
+    wrapper = LineWrapper.from_pdf(pdf)
+
+    line = "    " + " ".join(["ord", "längre_ord" * 8, "x"] * 30)
+    assert wrapper.wrap(line) == pdf.multi_cell(0, 6, line, split_only=True)
+    assert wrapper.wrap("kort rad") == ["kort rad"]
+
+
+def test_render_cache_replays_layout(tmp_path):
+    from render_cache import RenderCache
+    from renderer import layout_file
+    from textlayout import LineWrapper
+
+    source = tmp_path / "example.py"
+    source.write_text("x = 1\n" * 3, encoding="utf-8")
+    wrapper = LineWrapper([500] * 256, 500, 4.2, 170)
+    cache = RenderCache(str(tmp_path / "cache"))
+
+    first = layout_file(str(source), wrapper, cache=cache)
+    second = layout_file(str(source), wrapper, cache=cache)
+    assert first == second
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    source.write_text("x = 2\n", encoding="utf-8")
+    layout_file(str(source), wrapper, cache=cache)
+    assert cache.misses == 2
+
+
+def test_parallel_layout_keeps_file_order(tmp_path):
+    from renderer import layout_files
+    from textlayout import LineWrapper
+
+    files = []
+    for i in range(5):
+        path = tmp_path / f"file{i}.py"
+        path.write_text(f"# fil {i}\n" + "ord " * 200, encoding="utf-8")
+        files.append(str(path))
+    wrapper = LineWrapper([500] * 256, 500, 4.2, 170)
+
+    serial = list(layout_files(files, wrapper, workers=1))
+    parallel = list(layout_files(files, wrapper, workers=2))
+    assert parallel == serial
+    assert [file for file, runs in parallel] == files
+
+
+def test_layout_pool_only_starts_processes_for_cache_misses(tmp_path, monkeypatch):
+    import renderer
+    from render_cache import RenderCache
+    from textlayout import LineWrapper
+
+    files = []
+    for i in range(4):
+        path = tmp_path / f"file{i}.py"
+        path.write_text(f"x = {i}\n", encoding="utf-8")
+        files.append(str(path))
+    wrapper = LineWrapper([500] * 256, 500, 4.2, 170)
+    cache = RenderCache(str(tmp_path / "cache"))
+    for file in files[:3]:
+        renderer.layout_file(file, wrapper, cache)
+
+    pool_sizes = []
+    executor = renderer.ProcessPoolExecutor
+
+    def recording_executor(max_workers, **kwargs):
+        pool_sizes.append(max_workers)
+        return executor(max_workers=max_workers, **kwargs)
+
+    monkeypatch.setattr(renderer, "ProcessPoolExecutor", recording_executor)
+    laid_out = list(renderer.layout_files(files, wrapper, cache, workers=8))
+    assert [file for file, runs in laid_out] == files
+    assert pool_sizes == [1]
+
+
+def test_render_pdf_reports_progress_and_cancels(tmp_path):
+    from renderer import render_pdf, RenderCancelled
+
+    files = []
+    for i in range(3):
+        path = tmp_path / f"file{i}.py"
+        path.write_text(f"x = {i}\n", encoding="utf-8")
+        files.append(str(path))
+    output = tmp_path / "report.pdf"
+    seen = []
+
+    def progress(done, total, file):
+        seen.append((done, total, file))
+
+    with pytest.raises(RenderCancelled):
+        render_pdf(
+            files,
+            str(output),
+            "",
+            "",
+            "",
+            use_cache=False,
+            progress=progress,
+            is_cancelled=lambda: len(seen) >= 2,
+        )
+
+    assert seen == [(1, 3, files[0]), (2, 3, files[1])]
+    assert not output.exists()
+    assert not os.path.exists(str(output) + ".part")
+
+
+def test_stage_modules_are_imported_lazily():
+    import subprocess
+    import sys
+
+    code = (
+        "import sys, merger_utils, renderer; "
+        "print(sorted(m for m in ('sphinx', 'coverage', 'bs4', 'platformdirs') "
+        "if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == "[]"
+
+
+def test_summarize_database_counts_rows_read_only(tmp_path):
+    from dbsummary import summarize_database
+
+    path = tmp_path / "data.db"
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE "order items" (id INTEGER PRIMARY KEY, name TEXT)')
+    conn.executemany(
+        'INSERT INTO "order items" (name) VALUES (?)', [("a",), ("b",), ("c",)]
+    )
+    conn.commit()
+    conn.close()
+    before = path.read_bytes()
+
+    exact = summarize_database(str(path))
+    approximate = summarize_database(str(path), row_counts="approximate")
+
+    assert exact[0].name == "order items"
+    assert exact[0].columns == [("id", "INTEGER"), ("name", "TEXT")]
+    assert (exact[0].row_count, exact[0].approximate) == (3, False)
+    assert (approximate[0].row_count, approximate[0].approximate) == (3, True)
+    assert path.read_bytes() == before
+
+
+def test_database_preview_respects_budgets(tmp_path):
+    from dbsummary import summarize_database, PreviewOptions
+
+    path = tmp_path / "big.db"
+    conn = sqlite3.connect(path)
+    for table in ("a", "b"):
+        conn.execute(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY, text TEXT)")
+        conn.executemany(
+            f"INSERT INTO {table} (text) VALUES (?)", [("x" * 100,)] * 1000
+        )
+    conn.commit()
+    conn.close()
+
+    first = summarize_database(str(path), preview=PreviewOptions(5))
+    assert [len(table.preview) for table in first] == [5, 5]
+    assert first[0].preview[0] == ("1", "x" * 100)
+
+    # Rows are 101-104 bytes, so nine fit in the table budget
+    limited = PreviewOptions(1000, "random", table_bytes=1000, database_rows=15)
+    sampled = summarize_database(str(path), preview=limited)
+    assert [len(table.preview) for table in sampled] == [9, 6]
+    assert all(table.preview_truncated for table in sampled)
+
+
+def test_iter_lines_decodes_across_chunks(tmp_path):
+    from logreader import iter_lines
+
+    data = "rad 1 åäö\r\n€ rad 2\n".encode("utf-8") * 3 + b"trasig \xff\nsista"
+    path = tmp_path / "app.log"
+    path.write_bytes(data)
+
+    expected = data.decode("utf-8", errors="replace").split("\n")
+    for chunk_size in (1, 2, 3, 7, 1024):
+        assert list(iter_lines(str(path), chunk_size)) == expected
+
+
+def test_select_lines_by_time_window_and_tail(tmp_path):
+    from logreader import select_lines
+
+    path = tmp_path / "merge.log"
+    path.write_text(
+        "2024-05-01 10:00:00,001 - INFO - start\n"
+        "2024-05-01 10:30:00,002 - ERROR - fel\n"
+        "Traceback (most recent call last):\n"
+        "2024-05-01 11:00:00,003 - INFO - klar\n",
+        encoding="utf-8",
+    )
+
+    window = list(
+        select_lines(
+            str(path), since="2024-05-01 10:15:00", until="2024-05-01 10:59:59"
+        )
+    )
+    assert window == [
+        "2024-05-01 10:30:00,002 - ERROR - fel",
+        "Traceback (most recent call last):",
+        "",
+    ]
+    assert list(select_lines(str(path), tail=1)) == [
+        "2024-05-01 11:00:00,003 - INFO - klar",
+        "",
+    ]
+    assert list(select_lines(str(path), head=1)) == [
+        "2024-05-01 10:00:00,001 - INFO - start"
+    ]
+    assert list(select_lines(str(path), since="2024-05-02")) == []
+    assert list(select_lines(str(path), until="2024-05-01 09:00:00")) == []
+
+
+def test_collapse_repeats_counts_runs():
+    from logreader import collapse_repeats
+
+    lines = [
+        "2024-05-01 10:00:00,001 - INFO - hälsokontroll ok (12 ms)",
+        "2024-05-01 10:00:05,002 - INFO - hälsokontroll ok (9 ms)",
+        "2024-05-01 10:00:10,003 - INFO - hälsokontroll ok (11 ms)",
+        "klar",
+        "klar",
+        "",
+        "",
+    ]
+
+    assert list(collapse_repeats(lines)) == lines[:3] + ["klar ×2", "", ""]
+    assert list(collapse_repeats(lines, "similar")) == [
+        lines[0] + " ×3",
+        "klar ×2",
+        "",
+        "",
+    ]
+
+
+def test_font_registry_shares_metrics_between_documents(tmp_path):
+    from renderer import create_pdf
+
+    first = create_pdf(str(tmp_path / "a.pdf"))
+    second = create_pdf(str(tmp_path / "b.pdf"))
+
+    assert first.fonts["dejavu"]["cw"] is second.fonts["dejavu"]["cw"]
+    assert first.fonts["dejavu"]["subset"] is not second.fonts["dejavu"]["subset"]
+    assert first.width_tables["dejavuB"] is second.width_tables["dejavuB"]
+
+
+def test_subset_cache_reuses_embedded_font(tmp_path):
+    from font_subsets import SubsetCache
+    from renderer import create_pdf
+
+    cache = SubsetCache(str(tmp_path / "fonts"))
+    outputs = []
+    for name in ("a.pdf", "b.pdf"):
+        output = tmp_path / name
+        pdf = create_pdf(str(output), cache)
+        pdf.add_page()
+        pdf.cell(0, 10, "Räksmörgås", ln=True)
+        pdf.output(str(output))
+        outputs.append(output.read_bytes())
+
+    assert (cache.hits, cache.misses) == (2, 2)
+    font_streams = [
+        output[output.rindex(b"/Length1") : output.rindex(b"endstream")]
+        for output in outputs
+    ]
+    assert font_streams[0] == font_streams[1]
+
+
+def test_fast_font_parser_matches_fpdf():
+    from fpdf.ttfonts import TTFontFile
+    from ttfparser import FastTTFontFile
+    from renderer import FONT_FILE
+
+    codes = list(range(32, 127)) + [ord(c) for c in "åäöÅÄÖé×…"]
+    slow, fast = TTFontFile(), FastTTFontFile()
+    slow.getMetrics(FONT_FILE)
+    fast.getMetrics(FONT_FILE)
+    assert fast.charWidths == slow.charWidths
+    assert fast.defaultWidth == slow.defaultWidth
+    assert FastTTFontFile().makeSubset(FONT_FILE, codes) == TTFontFile().makeSubset(
+        FONT_FILE, codes
+    )
+
+
+def test_parallel_page_compression_matches_serial(tmp_path):
+    import re
+    from renderer import create_pdf
+
+    outputs = []
+    for workers in (1, 3, 3):
+        output = tmp_path / f"{len(outputs)}.pdf"
+        pdf = create_pdf(str(output), compress_level=1, compress_workers=workers)
+        for page in range(20):
+            pdf.add_page()
+            pdf.cell(0, 10, f"Sida {page} av {{nb}}" if page % 3 else "Text")
+        pdf.output(str(output))
+        outputs.append(re.sub(rb"/CreationDate \(D:\d+\)", b"", output.read_bytes()))
+
+    assert outputs[0] == outputs[1] == outputs[2]
+
+
+def test_render_cache_sees_rows_in_wal(tmp_path):
+    from render_cache import RenderCache
+    from renderer import layout_file
+    from textlayout import LineWrapper
+
+    db = tmp_path / "wal.db"
+    conn = sqlite3.connect(str(db))
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.commit()
+    wrapper = LineWrapper([500] * 256, 500, 4.2, 170)
+    cache = RenderCache(str(tmp_path / "cache"))
+
+    assert ("", 10, "  Antal rader: 0") in layout_file(str(db), wrapper, cache)
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(50)])
+    conn.commit()
+    assert ("", 10, "  Antal rader: 50") in layout_file(str(db), wrapper, cache)
+    conn.close()
+
+
+def test_apidoc_patterns_exclude_nested_directories(tmp_path):
+    from sphinx.ext import apidoc
+    from merger_utils import apidoc_exclude_patterns
+
+    root = tmp_path / "src"
+    for path in (
+        "merge.py",
+        "pkg/__init__.py",
+        "pkg/tools.py",
+        "mergeenv/__init__.py",
+        "mergeenv/site.py",
+        "pkg/build/__init__.py",
+        "pkg/build/gen.py",
+        "pkg/mergeenv/__init__.py",
+    ):
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_text("", encoding="utf-8")
+    out = tmp_path / "out"
+
+    apidoc.main(
+        ["--output-dir", str(out), str(root)]
+        + apidoc_exclude_patterns(str(root), ("mergeenv", "build"))
+    )
+    modules = (out / "modules.rst").read_text(encoding="utf-8")
+    pages = sorted(os.listdir(out))
+    assert "merge" in modules and "pkg" in modules
+    assert "pkg.rst" in pages
+    assert not [page for page in pages if "mergeenv" in page or "build" in page]
+    assert "mergeenv" not in (out / "pkg.rst").read_text(encoding="utf-8")
+
+
+def test_sync_tree_copies_changes_and_removes_stale_files(tmp_path):
+    from merger_utils import sync_tree
+
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    (src / "sub").mkdir(parents=True)
+    (src / "same.rst").write_text("samma", encoding="utf-8")
+    (src / "sub" / "changed.rst").write_text("gammal", encoding="utf-8")
+    (src / "old.rst").write_text("tas bort", encoding="utf-8")
+    assert sync_tree(str(src), str(dst)) == 3
+
+    unchanged = dst / "same.rst"
+    os.utime(unchanged, (1, 1))
+    (src / "sub" / "changed.rst").write_text("ny text", encoding="utf-8")
+    (src / "old.rst").unlink()
+    (src / "new.rst").write_text("ny", encoding="utf-8")
+
+    assert sync_tree(str(src), str(dst)) == 2
+    assert unchanged.stat().st_mtime == 1
+    assert (dst / "sub" / "changed.rst").read_text(encoding="utf-8") == "ny text"
+    assert (dst / "new.rst").exists()
+    assert not (dst / "old.rst").exists()
+
+
+def test_text_docs_cover_every_module(tmp_path, monkeypatch):
+    import merger_utils
+
+    root = tmp_path / "src"
+    root.mkdir()
+    for name in ("alpha", "beta", "gamma"):
+        (root / f"{name}.py").write_text(
+            f'def {name}_func():\n    """Dokumenterar {name}."""\n', encoding="utf-8"
+        )
+    monkeypatch.setattr(
+        merger_utils, "docs_cache_dir", lambda source_root: str(tmp_path / "cache")
+    )
+
+    docs = merger_utils.generate_docs(str(root), excludes=())
+    names = merger_utils.doc_names(str(tmp_path / "cache" / "source"))
+    assert names == ["index", "modules", "alpha", "beta", "gamma"]
+    for name in names:
+        assert f"--- {name} ---" in docs
+    assert "Dokumenterar beta." in docs
+
+
+def test_run_tests_without_python_reports_missing(tmp_path, monkeypatch):
+    import merger_utils
+
+    (tmp_path / "test_x.py").write_text("def test_x():\n    pass\n", encoding="utf-8")
+    monkeypatch.setattr(
+        merger_utils, "python_executable", lambda: str(tmp_path / "saknas")
+    )
+
+    report = merger_utils.run_tests(source_root=str(tmp_path), use_cache=False)
+    assert report == "Testrapport saknas"
+
+
+def write_test_project(root):
+    root.mkdir()
+    (root / "mod.py").write_text("def f():\n    return 1\n", encoding="utf-8")
+    (root / "test_a.py").write_text(
+        "from mod import f\n\n\ndef test_f():\n    assert f() == 1\n", encoding="utf-8"
+    )
+
+
+def test_run_tests_reuses_report_until_sources_change(tmp_path, monkeypatch):
+    import merger_utils
+
+    root = tmp_path / "src"
+    write_test_project(root)
+    cache_path = str(tmp_path / "tests.json")
+    monkeypatch.setattr(merger_utils, "tests_cache_path", lambda root: cache_path)
+    runs = []
+    run_test_shards = merger_utils.run_test_shards
+
+    def counting_run_test_shards(*args):
+        runs.append(args[0])
+        return run_test_shards(*args)
+
+    monkeypatch.setattr(merger_utils, "run_test_shards", counting_run_test_shards)
+
+    report = merger_utils.run_tests(source_root=str(root))
+    assert "mod.py: 2 satser, 0 missade, 100%" in report
+    assert merger_utils.run_tests(source_root=str(root)) == report
+    assert len(runs) == 1
+
+    with open(root / "mod.py", "a", encoding="utf-8") as f:
+        f.write("\n\nx = 2\n")
+    assert "mod.py: 3 satser" in merger_utils.run_tests(source_root=str(root))
+    assert len(runs) == 2
+
+
+def test_run_tests_does_not_store_broken_shards(tmp_path, monkeypatch):
+    import merger_utils
+
+    root = tmp_path / "src"
+    write_test_project(root)
+    (root / "test_b.py").write_text("import saknas\n", encoding="utf-8")
+    cache_path = tmp_path / "tests.json"
+    monkeypatch.setattr(merger_utils, "tests_cache_path", lambda root: str(cache_path))
+
+    report = merger_utils.run_tests(source_root=str(root), workers=2)
+    assert "mod.py: 2 satser, 0 missade, 100%" in report
+    assert report.endswith("Testprocess 2 avslutades med felkod 2")
+    assert not cache_path.exists()
+
+
+def test_run_tests_spreads_files_round_robin(tmp_path, monkeypatch):
+    import merger_utils
+
+    names = [f"test_{i}.py" for i in range(5)]
+    for name in names:
+        (tmp_path / name).write_text("", encoding="utf-8")
+    shards = []
+    monkeypatch.setattr(
+        merger_utils,
+        "run_test_shards",
+        lambda shard_files, *args: shards.extend(shard_files) or [0],
+    )
+
+    merger_utils.run_tests(source_root=str(tmp_path), workers=3, use_cache=False)
+    files = [str(tmp_path / name) for name in names]
+    assert shards == [files[0::3], files[1::3], files[2::3]]
+
+    shards.clear()
+    merger_utils.run_tests(source_root=str(tmp_path), workers=8, use_cache=False)
+    assert shards == [[name] for name in files]
+
+
+def test_run_test_shards_stops_hung_shard(tmp_path):
+    import time
+    import coverage
+    from merger_utils import run_test_shards
+
+    (tmp_path / "test_fast.py").write_text(
+        "def test_ok():\n    pass\n", encoding="utf-8"
+    )
+    (tmp_path / "test_hang.py").write_text(
+        "import time\n\n\ndef test_hang():\n    time.sleep(120)\n", encoding="utf-8"
+    )
+    shards = [[str(tmp_path / "test_fast.py")], [str(tmp_path / "test_hang.py")]]
+    cov = coverage.Coverage(data_file=str(tmp_path / ".coverage"))
+
+    start = time.monotonic()
+    assert run_test_shards(shards, str(tmp_path), cov, timeout=5) == [0, None]
+    assert time.monotonic() - start < 60
+
+
+def test_coverage_summary_lists_every_file(tmp_path):
+    from merger_utils import coverage_summary
+
+    class FakeData:
+        def measured_files(self):
+            return [str(tmp_path / "b.py"), str(tmp_path / "a.py")]
+
+    class FakeCoverage:
+        analyses = {"a.py": ([1, 2, 3, 4], [2]), "b.py": ([1, 2], [])}
+
+        def get_data(self):
+            return FakeData()
+
+        def analysis2(self, path):
+            statements, missing = self.analyses[os.path.basename(path)]
+            return path, statements, [], missing, ""
+
+    assert coverage_summary(FakeCoverage(), str(tmp_path)).splitlines() == [
+        "Täckning per fil (satser, missade, procent):",
+        "",
+        "a.py: 4 satser, 1 missade, 75%",
+        "b.py: 2 satser, 0 missade, 100%",
+        "",
+        "Totalt: 6 satser, 1 missade, 83%",
+    ]
+
+
+def test_coverage_summary_without_data_raises(tmp_path):
+    import coverage
+    from merger_utils import coverage_summary
+
+    cov = coverage.Coverage(data_file=str(tmp_path / ".coverage"))
+    with pytest.raises(ValueError):
+        coverage_summary(cov, str(tmp_path))
+
+
+def test_estimated_row_count_handles_sparse_keys(tmp_path):
+    import random
+    from dbsummary import summarize_database
+
+    path = tmp_path / "sparse.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE dense (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.execute("CREATE TABLE sparse (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.executemany("INSERT INTO dense VALUES (?, 'x')", [(i,) for i in range(5000)])
+    keys = random.Random(1).sample(range(1 << 60), 5000)
+    conn.executemany("INSERT INTO sparse VALUES (?, 'x')", [(k,) for k in keys])
+    conn.commit()
+    conn.close()
+
+    tables = summarize_database(str(path), row_counts="approximate")
+    counts = {table.name: table.row_count for table in tables}
+    assert counts["dense"] == 5000
+    assert 2500 < counts["sparse"] < 10000
+
+
+def test_parallel_database_layout_keeps_order_and_reports_errors(tmp_path):
+    from dbsummary import summarize_databases
+    from renderer import layout_database_files
+    from textlayout import LineWrapper
+
+    files = []
+    for i in range(4):
+        path = tmp_path / f"db{i}.db"
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.executemany("INSERT INTO t VALUES (?)", [(n,) for n in range(i * 10)])
+        conn.commit()
+        conn.close()
+        files.append(str(path))
+    bad = tmp_path / "bad.db"
+    bad.write_bytes(b"ingen databas" * 100)
+    files.insert(2, str(bad))
+
+    summaries = list(summarize_databases(files, workers=3))
+    assert [summary.file for summary in summaries] == files
+    assert [summary.error is not None for summary in summaries] == [
+        False, False, True, False, False
+    ]
+
+    errors = []
+    wrapper = LineWrapper([500] * 256, 500, 4.2, 170)
+    laid_out = list(
+        layout_database_files(files, wrapper, on_error=errors.append, workers=3)
+    )
+    assert [file for file, runs in laid_out] == files
+    for i, file in enumerate(files[:2] + files[3:]):
+        assert ("", 10, f"  Antal rader: {i * 10}") in dict(laid_out)[file]
+    assert len(errors) == 1 and "databasen" in errors[0]
+
+
+def test_database_preview_header_fits_the_regular_wrapper():
+    from dbsummary import TableInfo
+    from renderer import table_runs
+    from textlayout import LineWrapper
+
+    columns = [(f"kolumn_med_langt_namn_{i}", "TEXT") for i in range(12)]
+    table = TableInfo("t", columns, 1, False, (tuple("x" * 12),))
+    wrapper = LineWrapper([500] * 256, 500, 4.2, 170)
+
+    runs = table_runs([table], wrapper)
+    header = [text for style, h, text in runs if "kolumn_med_langt_namn_0" in text]
+    assert header
+    for style, h, text in runs:
+        if style not in ("ln", "page"):
+            assert sum(wrapper.char_widths(text)) <= wrapper.limit
+            assert style == "" or text == "Tabell: t"
+
+
+def test_large_logs_stream_past_the_cache_and_pool(tmp_path, monkeypatch):
+    import types
+    import renderer
+    from render_cache import RenderCache
+    from textlayout import LineWrapper
+
+    log = tmp_path / "big.log"
+    log.write_text("".join(f"rad {i}\n" for i in range(1000)), encoding="utf-8")
+    wrapper = LineWrapper([500] * 256, 500, 4.2, 170)
+    cache = RenderCache(str(tmp_path / "cache"))
+    expected = renderer.layout_file_body(str(log), wrapper)
+    monkeypatch.setattr(renderer, "STREAM_LOG_BYTES", 1024)
+    monkeypatch.setattr(renderer, "ProcessPoolExecutor", None)
+
+    runs = renderer.layout_file(str(log), wrapper, cache)
+    assert isinstance(runs, types.GeneratorType)
+    assert list(runs) == expected
+    ((file, runs),) = renderer.layout_files([str(log)], wrapper, cache, workers=4)
+    assert isinstance(runs, types.GeneratorType)
+    assert list(runs) == expected
+    assert (cache.hits, cache.misses) == (0, 0)
+    assert not (tmp_path / "cache").exists()
+
+
+def test_selected_logs_skip_the_cache(tmp_path):
+    from render_cache import RenderCache
+    from renderer import layout_file, LayoutOptions
+    from textlayout import LineWrapper
+
+    log = tmp_path / "app.log"
+    log.write_text("".join(f"rad {i}\n" for i in range(100)), encoding="utf-8")
+    wrapper = LineWrapper([500] * 256, 500, 4.2, 170)
+    cache = RenderCache(str(tmp_path / "cache"))
+
+    options = LayoutOptions(log_tail=3)
+    runs = list(layout_file(str(log), wrapper, cache, options=options))
+    assert [text for style, h, text in runs if style == ""] == [
+        "rad 97",
+        "rad 98",
+        "rad 99",
+        "",
+    ]
+    assert (cache.hits, cache.misses) == (0, 0)
+    layout_file(str(log), wrapper, cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_run_tests_skips_files_that_are_not_python(tmp_path, monkeypatch):
+    import merger_utils
+
+    root = tmp_path / "src"
+    write_test_project(root)
+    (root / "broken.py").write_text("def broken(:\n", encoding="utf-8")
+    monkeypatch.setattr(
+        merger_utils, "tests_cache_path", lambda root: str(tmp_path / "tests.json")
+    )
+
+    report = merger_utils.run_tests(source_root=str(root), use_cache=False)
+    assert "kunde inte analyseras: broken.py" in report
+    assert "mod.py: 2 satser, 0 missade, 100%" in report
+    assert "Totalt: 5 satser, 0 missade, 100%" in report
+
+
+def test_find_time_searches_a_log_without_timestamps_once(tmp_path, monkeypatch):
+    import logreader
+
+    path = tmp_path / "syslog.log"
+    path.write_text("May  1 10:00:00 host app: rad\n" * 20000, encoding="utf-8")
+    searched = []
+    pattern = logreader.LINE_TIMESTAMP
+
+    class CountingPattern:
+        def search(self, data, pos, endpos):
+            searched.append(endpos - pos)
+            return pattern.search(data, pos, endpos)
+
+    monkeypatch.setattr(logreader, "LINE_TIMESTAMP", CountingPattern())
+    lines = logreader.select_lines(str(path), since="2024-05-01 10:00:00")
+    assert list(lines) == []
+    assert sum(searched) <= path.stat().st_size + len(searched) * 64
+
+
+def test_count_arguments_reject_negative_values(capsys):
+    from merge import parse_args
+
+    args = parse_args(["--log-head", "5", "--log-tail", "2", "--workers", "0"])
+    assert (args.log_head, args.log_tail, args.workers) == (5, 2, 0)
+    for argv in (["--log-head", "-1"], ["--log-tail", "0"], ["--db-preview", "-3"]):
+        with pytest.raises(SystemExit):
+            parse_args(argv)
+        assert "måste vara minst" in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        parse_args(["--test-workers", "två"])
+    assert "ogiltigt heltal: två" in capsys.readouterr().err
+
+
+def test_log_until_takes_in_the_whole_day_or_minute(tmp_path):
+    from logreader import parse_time, parse_until, select_lines
+
+    assert parse_until("2024-05-01") == "2024-05-01 23:59:59"
+    assert parse_until("2024-05-01 12:30") == "2024-05-01 12:30:59"
+    assert parse_until("2024-05-01 12:30:15") == "2024-05-01 12:30:15"
+    assert parse_time("2024-05-01") == "2024-05-01 00:00:00"
+
+    path = tmp_path / "merge.log"
+    path.write_text(
+        "2024-05-01 12:30:00,001 - INFO - ett\n"
+        "2024-05-01 12:30:45,002 - INFO - två\n"
+        "2024-05-01 18:00:00,003 - INFO - tre\n"
+        "2024-05-02 08:00:00,004 - INFO - fyra\n",
+        encoding="utf-8",
+    )
+    day = list(select_lines(str(path), until=parse_until("2024-05-01")))
+    minute = list(select_lines(str(path), until=parse_until("2024-05-01 12:30")))
+    assert [line[-4:].strip() for line in day] == ["ett", "två", "tre", ""]
+    assert [line[-4:].strip() for line in minute] == ["ett", "två", ""]
+
+
+def test_cache_files_store_atomically_and_treat_bad_entries_as_missing(tmp_path):
+    from cache_files import load_pickle, store_pickle
+
+    path = tmp_path / "ab" / "entry.pkl"
+    assert load_pickle(str(path)) is None
+    store_pickle(str(path), [("", 6, "rad")])
+    assert load_pickle(str(path)) == [("", 6, "rad")]
+    assert os.listdir(path.parent) == ["entry.pkl"]
+    path.write_bytes(b"inte en pickle")
+    assert load_pickle(str(path)) is None
+
+
+def test_render_cache_prunes_least_recently_used_entries(tmp_path):
+    from render_cache import RenderCache
+
+    cache = RenderCache(str(tmp_path / "cache"), max_bytes=0)
+    runs = [("", 6, "x" * 1000)]
+    for i, key in enumerate(("aa1", "bb2", "cc3")):
+        cache.put(key, runs)
+        os.utime(cache.path(key), ns=(i * 10**9, i * 10**9))
+    cache.max_bytes = 2 * os.path.getsize(cache.path("aa1"))
+
+    assert cache.get("aa1") == runs
+    cache.prune()
+    assert [cache.contains(key) for key in ("aa1", "bb2", "cc3")] == [
+        True,
+        False,
+        True,
+    ]
+
+
+def test_database_preview_cuts_large_values_in_sql(tmp_path):
+    from dbsummary import summarize_database, preview_columns, PreviewOptions
+
+    path = tmp_path / "blobs.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, data BLOB, text TEXT)")
+    conn.execute(
+        "INSERT INTO t (data, text) VALUES (?, ?)", (b"\0" * 5000000, "å" * 1000000)
+    )
+    conn.execute("INSERT INTO t (data, text) VALUES (NULL, 'kort')")
+    conn.commit()
+
+    columns = [("id", "INTEGER"), ("data", "BLOB"), ("text", "TEXT")]
+    fetched = conn.execute(f"SELECT {preview_columns(columns)} FROM t").fetchall()
+    assert fetched == [(1, "<5000000 byte>", "å" * 201), (2, None, "kort")]
+    conn.close()
+
+    for mode in ("first", "random"):
+        preview = PreviewOptions(2, mode, table_bytes=10**6, database_bytes=10**6)
+        (table,) = summarize_database(str(path), preview=preview)
+        assert table.preview == (
+            ("1", "<5000000 byte>", "å" * 199 + "…"),
+            ("2", "NULL", "kort"),
+        )
+
+
+def test_run_tests_does_not_measure_generated_docs(tmp_path, monkeypatch):
+    import merger_utils
+
+    root = tmp_path / "src"
+    write_test_project(root)
+    (root / "docs").mkdir()
+    (root / "docs" / "conf.py").write_text("project = 'x'\n", encoding="utf-8")
+    (root / "docs" / "broken.py").write_text("def (:\n", encoding="utf-8")
+    monkeypatch.setattr(
+        merger_utils, "tests_cache_path", lambda root: str(tmp_path / "tests.json")
+    )
+
+    measured = [
+        os.path.relpath(path, root) for path in merger_utils.measured_files(str(root))
+    ]
+    assert measured == ["mod.py", "test_a.py"]
+    report = merger_utils.run_tests(source_root=str(root), use_cache=False)
+    assert "mod.py: 2 satser, 0 missade, 100%" in report
+    assert "docs" not in report
@@ -0,0 +1,67 @@
+from bisect import bisect_right
+from itertools import accumulate
+from fontmetrics import WidthTable
+
+
+class LineWrapper:
+    # Breaks lines to a fixed width using the glyph widths of one font/size.
+    # Every character is measured once; break points are found with a binary
+    # search over the running width instead of re-measuring the line.
+
+    def __init__(self, cw, missing_width, font_size, max_width, font_name=""):
+        self.font_name = font_name
+        self.font_size = font_size
+        self.max_width = max_width
+        if not isinstance(cw, WidthTable):
+            cw = WidthTable(cw, missing_width)
+        self.widths = cw
+        self.missing_width = missing_width or 500
+        # Widths in the font table are in 1/1000 of the font size
+        self.limit = max_width * 1000.0 / font_size
+
+    @classmethod
+    def from_pdf(cls, pdf, max_width=None):
+        if max_width is None:
+            max_width = pdf.w - pdf.r_margin - pdf.l_margin
+        font = pdf.current_font
+        width_tables = getattr(pdf, "width_tables", {})
+        return cls(
+            width_tables.get(font.get("fontkey"), font["cw"]),
+            font.get("desc", {}).get("MissingWidth"),
+            pdf.font_size,
+            # Same text area as FPDF.multi_cell, so lines are never re-wrapped
+            max_width - 2 * pdf.c_margin,
+            font.get("name", ""),
+        )
+
+    def layout_params(self):
+        # Everything besides the text itself that decides where lines break
+        return (self.font_name, self.font_size, self.max_width, self.missing_width)
+
+    def char_widths(self, text):
+        return self.widths.char_widths(text)
+
+    def wrap(self, line):
+        line = line.replace("\r", "")
+        widths = self.char_widths(line)
+        if sum(widths) <= self.limit:
+            return [line]
+
+        offsets = [0]
+        offsets.extend(accumulate(widths))
+        parts = []
+        start = 0
+        end = len(line)
+        while offsets[end] - offsets[start] > self.limit:
+            # Number of characters from start that still fit on the line
+            fit = bisect_right(offsets, offsets[start] + self.limit, start) - 1
+            space = line.rfind(" ", start + 1, fit + 1)
+            if space > start:
+                parts.append(line[start:space])
+                start = space + 1
+            else:
+                fit = max(fit, start + 1)
+                parts.append(line[start:fit])
+                start = fit
+        parts.append(line[start:])
+        return parts
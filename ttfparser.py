@@ -0,0 +1,311 @@
+import os
+import re
+import struct
+import warnings
+from fpdf.php import die
+from cache_files import store_pickle
+from fpdf.ttfonts import (
+    TTFontFile,
+    GF_MORE,
+    GF_WORDS,
+    GF_SCALE,
+    GF_XYSCALE,
+    GF_TWOBYTWO,
+    _TTF_MAC_HEADER,
+)
+
+SHORT = struct.Struct(">h")
+USHORT = struct.Struct(">H")
+ULONG = struct.Struct(">L")
+TABLE_ENTRY = struct.Struct(">HHLL")
+CMAP12_GROUP = struct.Struct(">LLL")
+
+
+def table_checksum(data):
+    # Sum of the big-endian 32-bit words modulo 2**32, as (high, low) halves
+    # like ttfonts.calcChecksum returns it
+    data += b"\0" * (-len(data) % 4)
+    total = sum(struct.unpack(f">{len(data) // 4}L", data)) & 0xFFFFFFFF
+    return total >> 16, total & 0xFFFF
+
+
+class FastTTFontFile(TTFontFile):
+    # TTFontFile that reads the font into memory once and decodes whole
+    # tables with struct, instead of a seek and a small read for every value.
+    # Results are identical to TTFontFile, including its quirks.
+
+    subsetting = False
+
+    def load(self, file):
+        with open(file, "rb") as f:
+            self.data = f.read()
+
+    def getMetrics(self, file):
+        self.load(file)
+        super().getMetrics(file)
+
+    def makeSubset(self, file, subset):
+        self.load(file)
+        self.subsetting = True
+        try:
+            return super().makeSubset(file, subset)
+        finally:
+            self.subsetting = False
+
+    def seek(self, pos):
+        self._pos = pos
+
+    def skip(self, delta):
+        self._pos += delta
+
+    def seek_table(self, tag, offset_in_table=0):
+        self._pos = self.tables[tag]["offset"] + offset_in_table
+        return self._pos
+
+    def read_tag(self):
+        self._pos += 4
+        return self.data[self._pos - 4 : self._pos].decode("latin1")
+
+    def read_short(self):
+        self._pos += 2
+        return SHORT.unpack_from(self.data, self._pos - 2)[0]
+
+    def read_ushort(self):
+        self._pos += 2
+        return USHORT.unpack_from(self.data, self._pos - 2)[0]
+
+    def read_ulong(self):
+        self._pos += 4
+        return ULONG.unpack_from(self.data, self._pos - 4)[0]
+
+    def get_ushort(self, pos):
+        return USHORT.unpack_from(self.data, pos)[0]
+
+    def get_ulong(self, pos):
+        return ULONG.unpack_from(self.data, pos)[0]
+
+    def get_chunk(self, pos, length):
+        if length < 1:
+            return b""
+        return self.data[pos : pos + length]
+
+    def get_table(self, tag):
+        pos, length = self.get_table_pos(tag)
+        if length == 0:
+            die(f"Truetype font ({self.filename}): error reading table: {tag}")
+        return self.data[pos : pos + length]
+
+    def unpack_array(self, fmt, pos, count):
+        return struct.unpack_from(f">{count}{fmt}", self.data, pos)
+
+    def getHMTX(self, numberOfHMetrics, numGlyphs, glyphToChar, scale):
+        # Works from the cmap getCMAP4/getCMAP12 kept instead of glyphToChar,
+        # so the cmap is not inverted into one list per glyph first
+        if self.subsetting:
+            # makeSubset only calls this for widths it never uses
+            return
+        start = self.tables["hmtx"]["offset"]
+        advances = self.unpack_array("H", start, numberOfHMetrics * 2)[::2]
+        # Negative advances (stored unsigned) count as 0. Glyphs past the
+        # last metric share its advance, and 65535 marks a width of 0.
+        # Glyphs share few distinct advances, each is scaled only once.
+        rounded = {
+            aw: int(round(scale * (aw if aw < 1 << 15 else 0) + 0.001)) or 65535
+            for aw in set(advances)
+        }
+        widths = list(map(rounded.__getitem__, advances))
+        self.defaultWidth = scale * (advances[0] if advances[0] < 1 << 15 else 0)
+        last = numberOfHMetrics - 1
+        trailing = advances[last]
+        if trailing >= 1 << 15 and (last == 0 or last in self.mapped_glyphs()):
+            trailing = 0
+        trailing = int(round(scale * trailing + 0.001)) or 65535
+
+        char_widths = [0] * 256 * 256
+        count = 0
+        for char, glyph in self.char_to_glyph.items():
+            if glyph == 0 or glyph >= numGlyphs:
+                continue
+            if char != 0 and char != 65535 and char < 196608:
+                char_widths[char] = widths[glyph] if glyph <= last else trailing
+                count += 1
+        # The first entry holds the number of characters in the font
+        char_widths[0] = count
+        self.charWidths = char_widths
+
+    def mapped_glyphs(self):
+        return set(self.char_to_glyph.values())
+
+    def getHMetric(self, numberOfHMetrics, gid):
+        start = self.tables["hmtx"]["offset"]
+        if gid < numberOfHMetrics:
+            return self.data[start + gid * 4 : start + gid * 4 + 4]
+        pos = start + (numberOfHMetrics - 1) * 4
+        lsb = start + numberOfHMetrics * 2 + gid * 2
+        return self.data[pos : pos + 2] + self.data[lsb : lsb + 2]
+
+    def getLOCA(self, indexToLocFormat, numGlyphs):
+        start = self.tables["loca"]["offset"]
+        if indexToLocFormat == 0:
+            self.glyphPos = [
+                offset * 2 for offset in self.unpack_array("H", start, numGlyphs)
+            ]
+        elif indexToLocFormat == 1:
+            self.glyphPos = list(self.unpack_array("L", start, numGlyphs))
+        else:
+            die(f"Unknown location table format {indexToLocFormat}")
+
+    def getGlyphs(self, originalGlyphIdx, nonlocals):
+        # Adds the components of composite glyphs to the subset
+        try:
+            glyphPos = self.glyphPos[originalGlyphIdx]
+            glyphLen = self.glyphPos[originalGlyphIdx + 1] - glyphPos
+        except IndexError:
+            warnings.warn(f"missing glyph {originalGlyphIdx}")
+            return
+        if not glyphLen:
+            return
+
+        pos = nonlocals["start"] + glyphPos
+        if SHORT.unpack_from(self.data, pos)[0] >= 0:
+            return
+        pos += 10
+        flags = GF_MORE
+        while flags & GF_MORE:
+            flags, glyphIdx = self.unpack_array("H", pos, 2)
+            pos += 4
+            if glyphIdx not in nonlocals["glyphSet"]:
+                nonlocals["glyphSet"][glyphIdx] = len(nonlocals["subsetglyphs"])
+                nonlocals["subsetglyphs"].append((glyphIdx, 1))
+            self.getGlyphs(glyphIdx, nonlocals)
+            pos += 4 if flags & GF_WORDS else 2
+            if flags & GF_SCALE:
+                pos += 2
+            elif flags & GF_XYSCALE:
+                pos += 4
+            elif flags & GF_TWOBYTWO:
+                pos += 8
+
+    def getCMAP4(self, unicode_cmap_offset, glyphToChar, charToGlyph):
+        self.maxUniChar = 0
+        length = self.get_ushort(unicode_cmap_offset + 2)
+        limit = unicode_cmap_offset + length
+        segCount = self.get_ushort(unicode_cmap_offset + 6) // 2
+        pos = unicode_cmap_offset + 14
+        endCount = self.unpack_array("H", pos, segCount)
+        pos += segCount * 2 + 2
+        startCount = self.unpack_array("H", pos, segCount)
+        pos += segCount * 2
+        idDelta = self.unpack_array("h", pos, segCount)
+        pos += segCount * 2
+        idRangeOffset_start = pos
+        idRangeOffset = self.unpack_array("H", pos, segCount)
+
+        for n in range(segCount):
+            chars = range(startCount[n], endCount[n] + 1)
+            if not chars:
+                continue
+            delta = idDelta[n]
+            if idRangeOffset[n] == 0:
+                glyphs = [(char + delta) & 0xFFFF for char in chars]
+            else:
+                # Glyph ids come from glyphIdArray, right after idRangeOffset
+                first = idRangeOffset_start + 2 * n + idRangeOffset[n]
+                glyphs = []
+                for i in range(len(chars)):
+                    offset = first + 2 * i
+                    glyph = self.get_ushort(offset) if offset < limit else 0
+                    if glyph != 0:
+                        glyph = (glyph + delta) & 0xFFFF
+                    glyphs.append(glyph)
+            charToGlyph.update(zip(chars, glyphs))
+            self.maxUniChar = max(self.maxUniChar, chars[-1])
+        self.char_to_glyph = charToGlyph
+
+    def getCMAP12(self, unicode_cmap_offset, glyphToChar, charToGlyph):
+        self.maxUniChar = 0
+        length = self.get_ulong(unicode_cmap_offset + 4)
+        grpCount = self.get_ulong(unicode_cmap_offset + 12)
+        if 2 + 2 + 4 + 4 + 4 + grpCount * 3 * 4 > length:
+            die("TTF format 12 cmap table too small")
+        pos = unicode_cmap_offset + 16
+        groups = self.data[pos : pos + grpCount * CMAP12_GROUP.size]
+        for startCharCode, endCharCode, glyph in CMAP12_GROUP.iter_unpack(groups):
+            chars = range(startCharCode, endCharCode + 1)
+            charToGlyph.update(zip(chars, range(glyph, glyph + len(chars))))
+            if chars and startCharCode < 196608:
+                self.maxUniChar = max(self.maxUniChar, min(endCharCode, 196607))
+        self.char_to_glyph = charToGlyph
+
+    def endTTFile(self, stm):
+        # Puts the subset font together in one join instead of growing a
+        # bytes object per table
+        tables = sorted(self.otables.items())
+        numTables = len(tables)
+        searchRange = 1
+        entrySelector = 0
+        while searchRange * 2 <= numTables:
+            searchRange = searchRange * 2
+            entrySelector = entrySelector + 1
+        searchRange = searchRange * 16
+        rangeShift = numTables * 16 - searchRange
+
+        version = 0x74727565 if _TTF_MAC_HEADER else 0x00010000
+        parts = [
+            struct.pack(
+                ">LHHHH", version, numTables, searchRange, entrySelector, rangeShift
+            )
+        ]
+        offset = 12 + numTables * 16
+        head_start = 0
+        for tag, data in tables:
+            if tag == "head":
+                head_start = offset
+            hi, lo = table_checksum(data)
+            parts.append(tag.encode("latin1"))
+            parts.append(TABLE_ENTRY.pack(hi, lo, offset, len(data)))
+            offset += (len(data) + 3) & ~3
+        for tag, data in tables:
+            parts.append(data + b"\0" * (-len(data) % 4))
+        stm = b"".join(parts)
+
+        hi, lo = table_checksum(stm)
+        adjustment = (0xB1B0AFBA - ((hi << 16) | lo)) & 0xFFFFFFFF
+        pos = head_start + 8
+        return stm[:pos] + ULONG.pack(adjustment) + stm[pos + 4 :]
+
+
+def metrics_path(font_file):
+    # Where FPDF.add_font looks for the pickled metrics of a TrueType font
+    return os.path.splitext(font_file)[0] + ".pkl"
+
+
+def font_metrics(font_file, fontkey):
+    # The metrics dictionary FPDF.add_font builds for a font without a .pkl
+    ttf = FastTTFontFile()
+    ttf.getMetrics(font_file)
+    desc = {
+        "Ascent": int(round(ttf.ascent, 0)),
+        "Descent": int(round(ttf.descent, 0)),
+        "CapHeight": int(round(ttf.capHeight, 0)),
+        "Flags": ttf.flags,
+        "FontBBox": "[%s %s %s %s]" % tuple(int(round(v, 0)) for v in ttf.bbox),
+        "ItalicAngle": int(ttf.italicAngle),
+        "StemV": int(round(ttf.stemV, 0)),
+        "MissingWidth": int(round(ttf.defaultWidth, 0)),
+    }
+    return {
+        "name": re.sub("[ ()]", "", ttf.fullName),
+        "type": "TTF",
+        "desc": desc,
+        "up": round(ttf.underlinePosition),
+        "ut": round(ttf.underlineThickness),
+        "ttffile": font_file,
+        "fontkey": fontkey,
+        "originalsize": os.stat(font_file).st_size,
+        "cw": ttf.charWidths,
+    }
+
+
+def write_metrics(font_file, fontkey):
+    store_pickle(metrics_path(font_file), font_metrics(font_file, fontkey))